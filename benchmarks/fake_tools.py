@@ -0,0 +1,335 @@
+"""
+Local stand-ins for the external tools used by printer-simulation.
+
+Every tool is a small wrapper script that runs this file, which then behaves like the
+real tool closely enough for printer-simulation to run end to end on a plain Linux box:
+
+- Viewers (firefox, eog, gedit, libreoffice) register a window after their start latency
+  and keep running until the window is closed (Alt+F4) or they are terminated.
+- wmctrl lists, activates and closes those windows, xprop reports the active window and
+  (with -spy) window list changes. Dialogs belong to the process of the window they were opened from.
+- input-simulation waits its latency plus the waits of the script. Ctrl+P opens a print dialog
+  (Firefox shows a preview first, its Enter opens the dialog), Enter there opens a "Save As"
+  file chooser, Enter in the chooser accepts the typed file name and Enter in the print dialog
+  "prints" to that file. Alt+F4 closes the active window.
+- lp and libreoffice --convert-to write PDFs after their latency. lp writes them in
+  FAKE_CUPS_PDF_OUT (~/PDF by default), like the Out setting of cups-pdf.
+- xdg-mime and xinput answer with plausible data.
+
+Latencies (in seconds) come from the FAKE_TOOL_LATENCY environment variable (JSON object).
+"""
+import os
+import re
+import sys
+import json
+import time
+import signal
+import shutil
+
+from typing import Dict, Optional
+
+
+TOOLS = ['firefox', 'eog', 'gedit', 'libreoffice', 'wmctrl', 'xprop', 'xdg-mime', 'xinput', 'input-simulation', 'lp']
+DEFAULT_LATENCY = {
+    'firefox': 0.3,
+    'firefox-remote': 0.05,  # New window in a running browser
+    'eog': 0.1,
+    'gedit': 0.1,
+    'libreoffice': 0.4,  # GUI start
+    'libreoffice-convert': 0.5,  # Fixed headless start, plus 'libreoffice-per-file' per document
+    'libreoffice-per-file': 0.05,
+    'input-simulation': 0.05,
+    'lp': 0.2,
+    'wmctrl': 0.0,
+    'xdg-mime': 0.0,
+    'xinput': 0.0,
+}
+
+
+def install_fake_tools(bin_dir: str, state_dir: str, latencies: Optional[Dict[str, float]] = None) -> Dict[str, str]:
+    """Create the wrapper scripts in `bin_dir` and return the environment variables needed to use them."""
+    os.makedirs(bin_dir, exist_ok=True)
+    os.makedirs(os.path.join(state_dir, "windows"), exist_ok=True)
+    os.makedirs(os.path.join(state_dir, "xinput"), exist_ok=True)
+    for tool in TOOLS:
+        path = os.path.join(bin_dir, tool)
+        with open(path, "w") as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.abspath(__file__)}" {tool} "$@"\n')
+        os.chmod(path, 0o755)
+    return {
+        "PATH": bin_dir + os.pathsep + os.environ.get("PATH", ""),
+        "FAKE_TOOL_STATE": state_dir,
+        "FAKE_TOOL_LATENCY": json.dumps(dict(DEFAULT_LATENCY, **(latencies or {}))),
+    }
+
+
+# Tool behaviour
+
+def _latency(name: str) -> float:
+    return float(json.loads(os.environ.get("FAKE_TOOL_LATENCY", "{}")).get(name, DEFAULT_LATENCY.get(name, 0.0)))
+
+
+def _windows_dir() -> str:
+    return os.path.join(os.environ["FAKE_TOOL_STATE"], "windows")
+
+
+def _active_file() -> str:
+    return os.path.join(os.environ["FAKE_TOOL_STATE"], "active")
+
+
+def _list_windows() -> Dict[int, dict]:
+    windows = {}
+    for name in os.listdir(_windows_dir()):
+        try:
+            with open(os.path.join(_windows_dir(), name)) as f:
+                windows[int(name)] = json.load(f)
+        except (OSError, ValueError):
+            continue
+    return windows
+
+
+def _active_window() -> Optional[int]:
+    windows = _list_windows()
+    try:
+        with open(_active_file()) as f:
+            wid = int(f.read())
+        if wid in windows:
+            return wid
+    except (OSError, ValueError):
+        pass
+    # Fall back to the most recent window, like a window manager would after a close
+    return max(windows, key=lambda w: windows[w]["created"], default=None)
+
+
+def _write_atomic(path: str, content: str):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def _viewer(title: str, latency: float):
+    """Show a window called `title` until it is closed or the process is terminated."""
+    time.sleep(latency)
+    wid = os.getpid()
+    window_file = os.path.join(_windows_dir(), str(wid))
+
+    def close(*_):
+        if os.path.exists(window_file):
+            os.remove(window_file)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, close)
+    _write_atomic(window_file, json.dumps({"title": title, "pid": os.getpid(), "created": time.time()}))
+    _write_atomic(_active_file(), str(wid))
+    while os.path.exists(window_file):
+        time.sleep(0.02)
+
+
+def _wmctrl(args):
+    if args[:1] in (["-l"], ["-lx"], ["-lp"]):
+        for wid, window in sorted(_list_windows().items()):
+            klass = " fake.Fake" if args[0] == "-lx" else ""
+            pid = f" {window['pid']}" if args[0] == "-lp" else ""
+            print(f"0x{wid:08x}  0{pid}{klass} fakehost {window['title']}")
+    elif args[:1] == ["-ia"] and len(args) > 1:
+        _write_atomic(_active_file(), str(int(args[1], 16)))
+    elif args[:1] == ["-ic"] and len(args) > 1:
+        try:
+            os.remove(os.path.join(_windows_dir(), str(int(args[1], 16))))
+        except FileNotFoundError:
+            pass
+
+
+def _xprop(args):
+    if "-spy" not in args:
+        if "_NET_ACTIVE_WINDOW" in args:
+            wid = _active_window()
+            print(f"_NET_ACTIVE_WINDOW(WINDOW): window id # 0x{wid or 0:x}")
+        return
+    last = None
+    while True:
+        current = sorted(os.listdir(_windows_dir()))
+        if current != last:
+            print("_NET_CLIENT_LIST(WINDOW): window id # " + ", ".join(current), flush=True)
+            last = current
+        time.sleep(0.02)
+
+
+def _open_dialog(title: str, owner: Optional[int] = None, **attrs):
+    """Open a dialog of the program of window `owner` (the active window by default)."""
+    wid = 0x7000000 + time.time_ns() // 1000 % 0xffffff
+    pid = _list_windows().get(owner or _active_window(), {}).get("pid", 0)
+    _write_atomic(os.path.join(_windows_dir(), str(wid)), json.dumps(dict(attrs, title=title, pid=pid, created=time.time(), dialog=True)))
+    _write_atomic(_active_file(), str(wid))
+
+
+def _dialog(title: str):
+    """Return the (wid, window) of the open dialog called `title`, or (None, None)."""
+    return next(((wid, w) for wid, w in _list_windows().items() if w.get("dialog") and w["title"] == title), (None, None))
+
+
+def _close_window(wid: int):
+    try:
+        os.remove(os.path.join(_windows_dir(), str(wid)))
+    except FileNotFoundError:
+        pass
+
+
+def _press_enter():
+    """Enter in the print flow: open the print dialog from the Firefox preview, open the file chooser, accept it or print."""
+    preview_file = os.path.join(os.environ["FAKE_TOOL_STATE"], "preview")
+    print_wid, print_dialog = _dialog("Print")
+    chooser_wid, chooser = _dialog("Save As")
+    if os.path.exists(preview_file):
+        with open(preview_file) as f:
+            browser_wid = int(f.read())
+        os.remove(preview_file)
+        _open_dialog("Print", owner=browser_wid)
+    elif chooser is not None:
+        if chooser.get("output"):  # The chooser does not close without a file name
+            _close_window(chooser_wid)
+            if print_dialog is not None:
+                print_dialog["output"] = chooser["output"]
+                _write_atomic(os.path.join(_windows_dir(), str(print_wid)), json.dumps(print_dialog))
+                _write_atomic(_active_file(), str(print_wid))
+    elif print_dialog is not None and print_dialog.get("output"):
+        # Printing to a file "prints" the PDF
+        output = print_dialog["output"]
+        if os.path.isdir(os.path.dirname(output) or "."):
+            with open(output, "w") as f:
+                f.write("%PDF-1.4\n% fake\n")
+        _close_window(print_wid)
+    elif print_dialog is not None:
+        _open_dialog("Save As")  # Printing to a file from the print dialog asks for the file name
+
+
+def _input_simulation(args):
+    sequence = args[-1] if args else ""
+    # Honour the waits of the script: the initial --sleep and every S,<seconds> step
+    waits = [float(a.split("=", 1)[1]) for a in args[:-1] if a.startswith("--sleep=")]
+    waits += [float(seconds) for seconds in re.findall(r'(?:^| )S,([0-9.]+)', sequence)]
+    time.sleep(_latency("input-simulation") + sum(waits))
+
+    for step in re.findall(r'K,[^ ]+|T,"[^"]*"', sequence):
+        if step == "K,Ctrl+P":
+            active = _list_windows().get(_active_window(), {})
+            if active.get("title", "").endswith("Mozilla Firefox"):
+                # Firefox shows its print preview in the browser window, its Enter opens the print dialog
+                _write_atomic(os.path.join(os.environ["FAKE_TOOL_STATE"], "preview"), str(_active_window()))
+            else:
+                _open_dialog("Print")
+        elif step.startswith('T,"') and step.endswith('.pdf"'):
+            chooser_wid, chooser = _dialog("Save As")
+            if chooser is not None:
+                chooser["output"] = step[3:-1]
+                _write_atomic(os.path.join(_windows_dir(), str(chooser_wid)), json.dumps(chooser))
+        elif step in ("K,Enter", "K,Enter,2"):
+            for _ in range(int(step.split(",")[2]) if step.count(",") == 2 else 1):
+                _press_enter()
+        elif step.startswith("K,Alt+F4"):
+            wid = _active_window()
+            if wid is not None:
+                try:
+                    os.remove(os.path.join(_windows_dir(), str(wid)))
+                except FileNotFoundError:
+                    pass
+
+
+def _libreoffice(args):
+    if "--invisible" in args:
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        while True:  # A background instance, without any window
+            time.sleep(1)
+    if "--convert-to" not in args:
+        files = [a for a in args if not a.startswith("-")]
+        title = f"{os.path.basename(files[0])} - LibreOffice Writer" if files else "LibreOffice"
+        _viewer(title, _latency("libreoffice"))
+        return
+    outdir = args[args.index("--outdir") + 1] if "--outdir" in args else os.getcwd()
+    skip = {args.index("--convert-to") + 1}
+    if "--outdir" in args:
+        skip.add(args.index("--outdir") + 1)
+    files = [a for i, a in enumerate(args) if i not in skip and not a.startswith("-") and os.path.isfile(a)]
+    time.sleep(_latency("libreoffice-convert"))
+    for file in files:
+        time.sleep(_latency("libreoffice-per-file"))
+        stem = os.path.splitext(os.path.basename(file))[0]
+        with open(os.path.join(outdir, stem + ".pdf"), "w") as f:
+            f.write("%PDF-1.4\n% fake\n")
+
+
+def _lp(args):
+    file = args[-1]
+    # Like cups-pdf, name the PDF after the job title, with the characters it does not keep replaced
+    title = args[args.index("-t") + 1] if "-t" in args else os.path.basename(file)
+    pid = os.fork()
+    if pid:
+        return  # lp returns as soon as the job is queued, the "printer" works in the background
+    time.sleep(_latency("lp"))
+    spool = os.environ.get("FAKE_CUPS_PDF_OUT") or os.path.join(os.path.expanduser("~"), "PDF")  # Out of cups-pdf.conf
+    name = re.sub(r"[^\w.-]", "_", title)
+    tmp_path = os.path.join(spool, f".{name}.tmp")
+    shutil.copyfile(file, tmp_path)
+    os.replace(tmp_path, os.path.join(spool, name + ".pdf"))
+    os._exit(0)
+
+
+def _xdg_mime(args):
+    if args[:2] == ["query", "filetype"]:
+        print("text/plain")
+    elif args[:2] == ["query", "default"]:
+        print("org.gnome.gedit.desktop")
+
+
+def _xinput(args):
+    state = os.path.join(os.environ["FAKE_TOOL_STATE"], "xinput")
+    if args[:1] == ["list"]:
+        print("⎡ Virtual core pointer                    	id=2	[master pointer  (3)]")
+        print("⎜   ↳ Virtual core XTEST pointer              	id=4	[slave  pointer  (2)]")
+        for dev_id, name in [(9, "Fake Mouse"), (10, "Fake Keyboard")]:
+            print(f"⎜   ↳ {name}                          	id={dev_id}	[slave  pointer  (2)]")
+            if "--long" in args and os.path.exists(os.path.join(state, str(dev_id))):
+                print("	This device is disabled")
+    elif args[:1] == ["disable"]:
+        open(os.path.join(state, args[1]), "w").close()
+    elif args[:1] == ["enable"]:
+        try:
+            os.remove(os.path.join(state, args[1]))
+        except FileNotFoundError:
+            pass
+
+
+def main():
+    tool, args = sys.argv[1], sys.argv[2:]
+    files = [a for a in args if not a.startswith("-")]
+    if tool == "firefox":
+        title = f"{os.path.basename(files[-1]) if files else 'Mozilla Firefox'} — Mozilla Firefox"
+        if any(w["title"].endswith("Mozilla Firefox") for w in _list_windows().values()):
+            # Like the real remote command: the running browser opens the window and the command exits
+            if os.fork() == 0:
+                os.setsid()
+                _viewer(title, _latency("firefox-remote"))
+                os._exit(0)
+            return
+        _viewer(title, _latency("firefox"))
+    elif tool == "eog":
+        _viewer(os.path.basename(files[-1]) if files else "Image Viewer", _latency("eog"))
+    elif tool == "gedit":
+        _viewer(f"{os.path.basename(files[-1]) if files else 'Untitled Document 1'} - gedit", _latency("gedit"))
+    elif tool == "libreoffice":
+        _libreoffice(args)
+    else:
+        time.sleep(_latency(tool))
+        {
+            "wmctrl": _wmctrl,
+            "xprop": _xprop,
+            "xdg-mime": _xdg_mime,
+            "xinput": _xinput,
+            "input-simulation": _input_simulation,
+            "lp": _lp,
+        }[tool](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+End-to-end benchmark for printer-simulation.
+
+Runs print_visually_linux and print_invisibly_linux against the local stand-ins of
+benchmarks/fake_tools.py, so it works on any Linux box without a desktop, LibreOffice
+or CUPS. Reports the time spent in each phase and the jobs per second of each mode.
+
+Usage:
+    python benchmarks/harness.py [--files 4] [--modes visible,invisible] [--jobs 4]
+                                 [--latency lp=0.5 --latency firefox=1.0]
+                                 [--save baseline.json] [--compare baseline.json]
+"""
+import os
+import sys
+import json
+import time
+import zipfile
+import argparse
+import tempfile
+import functools
+import statistics
+
+from typing import Dict, List, Optional
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_tools import install_fake_tools  # noqa: E402
+
+
+# Module functions timed as phases. Internal calls go through the module globals, so wrapping them is enough.
+PHASES = [
+    'get_mime_info',
+    'start_print_process_visually',
+    'wait_for_program',
+    'input_simulation',
+    'open_pdf_linux',
+    'close_failsafe',
+    'sleep_action',
+    'sleep',
+    'convert_with_libreoffice',
+    'start_print_process_invisibly',
+]
+
+
+def make_corpus(directory: str, per_type: int) -> List[str]:
+    """Create `per_type` small files of each type handled by printer-simulation (text, image, office, PDF)."""
+    os.makedirs(directory, exist_ok=True)
+    files = []
+    for i in range(per_type):
+        path = os.path.join(directory, f"note-{i}.txt")
+        with open(path, "w") as f:
+            f.write(f"Benchmark note {i}\n" * 20)
+        files.append(path)
+
+        path = os.path.join(directory, f"image-{i}.png")
+        with open(path, "wb") as f:
+            f.write(b"\x89PNG\r\n\x1a\n" + bytes(64))
+        files.append(path)
+
+        path = os.path.join(directory, f"report-{i}.odt")
+        with zipfile.ZipFile(path, "w") as z:
+            z.writestr("mimetype", "application/vnd.oasis.opendocument.text", compress_type=zipfile.ZIP_STORED)
+            z.writestr("content.xml", "<office:document-content/>")
+        files.append(path)
+
+        path = os.path.join(directory, f"paper-{i}.pdf")
+        with open(path, "w") as f:
+            f.write("%PDF-1.4\n% benchmark\n")
+        files.append(path)
+    return files
+
+
+class PhaseTimer:
+    """Wrap module functions and record how long each call takes."""
+
+    def __init__(self, module, names: List[str]):
+        self.module = module
+        self.names = names
+        self.samples: Dict[str, List[float]] = {}
+        self._originals = {}
+
+    def _wrap(self, name: str, function):
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.samples.setdefault(name, []).append(time.perf_counter() - start)
+        return timed
+
+    def __enter__(self):
+        for name in self.names:
+            function = getattr(self.module, name, None)
+            if function is not None:
+                self._originals[name] = function
+                setattr(self.module, name, self._wrap(name, function))
+        return self
+
+    def __exit__(self, *exc):
+        for name, function in self._originals.items():
+            setattr(self.module, name, function)
+
+    def summary(self) -> Dict[str, dict]:
+        result = {}
+        for name, samples in self.samples.items():
+            ordered = sorted(samples)
+            result[name] = {
+                "count": len(samples),
+                "total": sum(samples),
+                "mean": statistics.mean(samples),
+                "p50": ordered[len(ordered) // 2],
+                "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+            }
+        return result
+
+
+def run_mode(ps, mode: str, files: List[str], output: str, jobs: int) -> dict:
+    """Print `files` in `mode` and return its wall time, jobs per second, failures and per-phase timings."""
+    os.makedirs(output, exist_ok=True)
+    with PhaseTimer(ps, PHASES) as timer:
+        start = time.perf_counter()
+        if mode == "visible":
+            errors = {}
+            try:
+                if ps.VISUAL_PIPELINE:
+                    ps.print_visually_linux(files, 0.0, output)  # The pipeline needs the whole batch
+                else:
+                    for file in files:
+                        try:
+                            ps.print_visually_linux([file], 0.0, output)
+                        except Exception as e:
+                            errors[file] = e
+            finally:
+                ps.close_app_instances()
+                ps.REAPER.shutdown()
+        else:
+            errors = ps.print_invisibly_linux(files, output, jobs=jobs)
+        elapsed = time.perf_counter() - start
+    return {
+        "files": len(files),
+        "failed": len(errors),
+        "wall": elapsed,
+        "jobs_per_second": len(files) / elapsed if elapsed else 0.0,
+        "phases": timer.summary(),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Return the modes whose throughput dropped or whose phases got slower than `tolerance` (a fraction)."""
+    regressions = []
+    for mode, metrics in results.items():
+        old = baseline.get(mode)
+        if not old:
+            continue
+        if metrics["jobs_per_second"] < old["jobs_per_second"] * (1 - tolerance):
+            regressions.append(f"{mode} jobs/s: {old['jobs_per_second']:.2f} -> {metrics['jobs_per_second']:.2f}")
+        for phase, stats in metrics["phases"].items():
+            old_p50 = old["phases"].get(phase, {}).get("p50")
+            if old_p50 and stats["p50"] > old_p50 * (1 + tolerance):
+                regressions.append(f"{mode} {phase} p50: {old_p50 * 1000:.1f} ms -> {stats['p50'] * 1000:.1f} ms")
+    return regressions
+
+
+def _parse_latency(value: str):
+    tool, _, seconds = value.partition("=")
+    try:
+        return tool, float(seconds)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid latency '{value}', expected tool=seconds.") from None
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark printer-simulation end to end against fake external tools.")
+    parser.add_argument("--files", type=int, default=2, help="Files of each type (text, image, office, PDF). Default: 2.")
+    parser.add_argument("--modes", type=str, default="visible,invisible", help="Comma separated modes to run. Default: visible,invisible.")
+    parser.add_argument("--jobs", type=int, default=4, help="Parallel jobs in invisible mode. Default: 4.")
+    parser.add_argument("--reuse-apps", action="store_true", help="Keep one instance of each application in visible mode (--reuse-apps).")
+    parser.add_argument("--pipeline", action="store_true", help="Launch the next program while the current output is read in visible mode (--pipeline).")
+    parser.add_argument("--spool-dir", action="store_true", help="Let the fake CUPS write next to the outputs instead of ~/PDF (--spool-dir).")
+    parser.add_argument("--render-cache", action="store_true", help="Reuse the PDFs of inputs with the same content in invisible mode (--render-cache).")
+    parser.add_argument("--latency", type=_parse_latency, action="append", default=[], help="Latency of a fake tool, as tool=seconds. Can be repeated.")
+    parser.add_argument("--save", type=str, help="Save the results as a JSON baseline.")
+    parser.add_argument("--compare", type=str, help="Compare the results against a JSON baseline and fail on regressions.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown against the baseline (fraction). Default: 0.2.")
+    parser.add_argument("--debug", action="store_true", help="Show the printer-simulation log.")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="printer-simulation-harness-") as tmp:
+        home = os.path.join(tmp, "home")
+        os.makedirs(os.path.join(home, "PDF"))
+        env = install_fake_tools(os.path.join(tmp, "bin"), os.path.join(tmp, "state"), dict(args.latency))
+        os.environ.update(env, HOME=home)
+        if args.spool_dir:
+            os.environ["FAKE_CUPS_PDF_OUT"] = os.path.join(tmp, "out", "spool")
+        os.environ.pop("DISPLAY", None)  # Never touch a real session
+
+        sys.path.insert(0, REPO_DIR)
+        import printer_simulation as ps
+        ps._setup_console_logging(args.debug)
+        ps.REUSE_APPS = args.reuse_apps
+        ps.VISUAL_PIPELINE = args.pipeline
+        ps.CUPS_SPOOL_DIR = os.environ.get("FAKE_CUPS_PDF_OUT")
+        ps.RENDER_CACHE = args.render_cache
+        if not args.debug:
+            ps.logger.setLevel("WARNING")
+
+        files = make_corpus(os.path.join(tmp, "corpus"), max(1, args.files))
+        results = {}
+        for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+            if mode not in ("visible", "invisible"):
+                parser.error(f"Unknown mode '{mode}'.")
+            results[mode] = r = run_mode(ps, mode, files, os.path.join(tmp, "out", mode), args.jobs)
+            print(f"{mode}: {r['files']} files in {r['wall']:.2f} s, {r['jobs_per_second']:.2f} jobs/s, {r['failed']} failed")
+            for phase, stats in sorted(r["phases"].items(), key=lambda item: -item[1]["total"]):
+                print(
+                    f"  {phase:<30} n={stats['count']:<4} total {stats['total']:7.2f} s  "
+                    f"p50 {stats['p50'] * 1000:8.1f} ms  p95 {stats['p95'] * 1000:8.1f} ms"
+                )
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.save}.")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
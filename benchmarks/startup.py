@@ -0,0 +1,136 @@
+"""
+Startup benchmark for printer-simulation.
+
+Measures the time-to-first-action of an invisible run: the time from starting the
+process until it invokes its first external tool (the LibreOffice conversion of a
+sample document). The required binaries are replaced by instant stand-ins, so only
+the startup cost of printer-simulation itself is measured.
+
+Usage:
+    python benchmarks/startup.py [--runs 10] [--binary dist/printer-simulation]
+                                 [--save baseline.json] [--compare baseline.json]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+from typing import List, Optional
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(REPO_DIR, "printer_simulation.py")
+DEFAULT_BINARY = os.path.join(REPO_DIR, "dist", "printer-simulation")
+REQUIRED_BINARIES = ['firefox', 'eog', 'libreoffice', 'gedit', 'wmctrl', 'input-simulation', 'lp', 'xdg-mime']
+
+
+def _write_fake_tools(bin_dir: str, marker: str):
+    """Create instant stand-ins for the external tools. libreoffice records when it is first called."""
+    for name in REQUIRED_BINARIES:
+        path = os.path.join(bin_dir, name)
+        with open(path, "w") as f:
+            f.write("#!/bin/sh\n")
+            if name == "libreoffice":
+                f.write(f'[ -f "{marker}" ] || date +%s.%N > "{marker}"\n')
+            f.write("exit 0\n")
+        os.chmod(path, 0o755)
+
+
+def measure(command: List[str], runs: int) -> dict:
+    """Run `command` several times and return its time-to-first-action and total time statistics (in seconds)."""
+    with tempfile.TemporaryDirectory(prefix="printer-simulation-bench-") as tmp:
+        bin_dir = os.path.join(tmp, "bin")
+        home = os.path.join(tmp, "home")
+        os.makedirs(bin_dir)
+        os.makedirs(home)
+        marker = os.path.join(tmp, "first-action")
+        _write_fake_tools(bin_dir, marker)
+        sample = os.path.join(tmp, "sample.odt")
+        open(sample, "w").close()
+
+        env = dict(os.environ, HOME=home, PATH=bin_dir + os.pathsep + os.environ.get("PATH", ""))
+        first_action = []
+        total = []
+        for _ in range(runs):
+            if os.path.exists(marker):
+                os.remove(marker)
+            start = time.time()
+            subprocess.run(
+                command + ["--invisible", sample, "--output", tmp],
+                env=env,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            )
+            total.append(time.time() - start)
+            if not os.path.exists(marker):
+                raise RuntimeError(f"{' '.join(command)} never reached its first action.")
+            with open(marker) as f:
+                first_action.append(float(f.read().strip()) - start)
+
+    return {
+        "runs": runs,
+        "cold_first_action": first_action[0],
+        "first_action_median": statistics.median(first_action),
+        "first_action_min": min(first_action),
+        "first_action_max": max(first_action),
+        "total_median": statistics.median(total),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Return the metrics that got slower than the baseline by more than `tolerance` (a fraction)."""
+    regressions = []
+    for target, metrics in results.items():
+        for metric in ("first_action_median", "cold_first_action"):
+            old = baseline.get(target, {}).get(metric)
+            if old and metrics[metric] > old * (1 + tolerance):
+                regressions.append(f"{target} {metric}: {old * 1000:.1f} ms -> {metrics[metric] * 1000:.1f} ms")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Measure the time-to-first-action of printer-simulation.")
+    parser.add_argument("--runs", type=int, default=10, help="Runs per target. The first one is the cold start. Default: 10.")
+    parser.add_argument("--binary", type=str, default=DEFAULT_BINARY, help=f"Packaged (PyInstaller) binary to measure, skipped if missing. Default: {DEFAULT_BINARY}.")
+    parser.add_argument("--save", type=str, help="Save the results as a JSON baseline.")
+    parser.add_argument("--compare", type=str, help="Compare the results against a JSON baseline and fail on regressions.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown against the baseline (fraction). Default: 0.2.")
+    args = parser.parse_args(argv)
+
+    targets = {"script": [sys.executable, SCRIPT]}
+    if os.path.exists(args.binary):
+        targets["binary"] = [args.binary]
+    else:
+        print(f"Packaged binary {args.binary} not found, measuring only the script.")
+
+    results = {}
+    for target, command in targets.items():
+        results[target] = measure(command, max(1, args.runs))
+        r = results[target]
+        print(
+            f"{target:>6}: first action cold {r['cold_first_action'] * 1000:.1f} ms, "
+            f"median {r['first_action_median'] * 1000:.1f} ms "
+            f"(min {r['first_action_min'] * 1000:.1f}, max {r['first_action_max'] * 1000:.1f}), "
+            f"total median {r['total_median'] * 1000:.1f} ms"
+        )
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.save}.")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
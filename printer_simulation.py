@@ -1,57 +1,375 @@
 import os
+import sys
+import json
 import random
 import subprocess
 import time
 import re
+import select
 import logging
+import logging.handlers
 import argparse
 import shutil
 import importlib.util
+import tempfile
+import threading
+import queue
+import struct
+import mimetypes
+import hashlib
+import signal
+import itertools
+import fcntl
+import contextlib
+import atexit
+import functools
+import errno
+import stat
 
 from time import sleep
 from pathlib import Path
-from typing import List, Optional, Tuple, Union
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
 from logging.handlers import RotatingFileHandler
 
+if TYPE_CHECKING:
+    # Imported by the functions that use them: every run would pay for them otherwise
+    import importlib.metadata
+    import socket
+
 
 # Globals
 
 FILE_PROGRAM_PROC = None
 PRINT_PROGRAM_PROC = None
+INPUT_SESSION = None  # Persistent input-simulation worker, only alive while the input lock is held
 CONTENTION_THRESHOLD = 0.5  # Seconds to consider that there is contention on the lock (i.e., that it was not acquired immediately)
+WINDOW_WAIT_TIMEOUT = 60.0  # Seconds to wait for a program window to show up
+WINDOW_SETTLE_DELAY = 0.0  # Extra seconds to wait once the program window is mapped
+LIBREOFFICE_BATCH_SIZE = 50  # Maximum number of files converted by a single headless LibreOffice run
+LIBREOFFICE_POOL_SIZE = 0  # Number of warm headless LibreOffice instances for invisible mode (0 disables the pool)
+LIBREOFFICE_POOL_RECYCLE = 100  # Documents converted by a pooled LibreOffice instance before it is restarted
+LIBREOFFICE_POOL_CONNECT_TIMEOUT = 60.0  # Seconds to wait for a pooled LibreOffice instance to accept UNO connections
+LIBREOFFICE_POOL = None
+SPOOL_WAIT_TIMEOUT = 30.0  # Seconds to wait for CUPS to finish writing the PDF of a job
+SPOOL_POLL_INTERVAL = 0.5  # Seconds between directory scans when inotify is not available
+CUPS_SPOOL_DIR = None  # Directory where cups-pdf writes the PDFs (its Out setting), ~/PDF if not set
+RENDER_CACHE = False  # Reuse the PDFs already rendered for inputs with the same content in invisible mode
+RENDER_CACHE_MAX_SIZE = 1024  # MiB kept in the render cache, the least recently used PDFs are evicted first
+INVISIBLE_JOBS = 1  # Files handled concurrently in invisible mode
+MIME_CACHE_MAX_ENTRIES = 100000  # Classified files remembered between runs
+DIR_INDEX = False  # Keep a persisted listing of sampled directories, refreshed when their mtime changes
+NO_REPEAT = False  # Do not pick again files already printed from a directory until all of them have been
+LOCK_TIMEOUT = None  # Seconds to wait for the printer and input locks (None waits forever, 0 only tries once)
+LOCK_PRIORITY = 0  # Waiters with a higher priority are served first, equal priorities in arrival order
+INPUT_TOGGLE_TIMEOUT = 2.0  # Seconds to wait for xinput to report the new state of the input devices
+CONDITION_TIMEOUT_DEFAULT = 5.0  # Seconds to wait for a print dialog or output file before any wait has been observed
+CONDITION_TIMEOUT_MIN = 1.0  # Bounds of the timeouts learned from the recent waits of each application
+CONDITION_TIMEOUT_MAX = 30.0
+CONDITION_TIMEOUT_FACTOR = 3.0  # Learned timeout, as a multiple of the slowest recent wait
+CONDITION_POLL_INTERVAL = 0.1  # Seconds between checks of a print flow condition
+INPUT_PRESS_INTERVAL = 0.5  # Human pacing of the print dialog: seconds between key presses
+INPUT_TYPING_INTERVAL = 0.2  # Human pacing of the print dialog: seconds between typed characters
+REUSE_APPS = False  # Keep one instance of each application for the whole visible run instead of one per file
+MAX_DOCS_PER_APP = 20  # Documents opened in a reused application instance before it is restarted
+VISUAL_PIPELINE = False  # Launch the program of the next file while the output of the current one is being read
+TRACER = None  # Collects the timed spans of the print jobs when --trace or --trace-chrome is given
+LOCK_DIR = os.path.join("/", "opt", "locks")  # Directory shared by every process of the host, writable by all its users (sticky, like /tmp)
+SESSION_CACHE_FILE = os.path.join(LOCK_DIR, "session.json")  # Graphical session found by the first process
+DEFAULT_SOCKET_PATH = os.path.join(os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir(), "printer-simulation.sock")
 
 
 # Logging setup
 
 LOG_PATH = os.path.join(os.path.expanduser('~'), ".config", "printer-simulation")
 os.makedirs(LOG_PATH, exist_ok=True)
+CACHE_PATH = os.path.join(os.path.expanduser('~'), ".cache", "printer-simulation")
 
 format_str = "%(asctime)s [PID %(process)d] - %(funcName)s - %(levelname)s - %(message)s"
 class LevelBasedFormatter(logging.Formatter):
     """Custom formatter to change format based on log level."""
+    info_formatter = logging.Formatter("%(message)s")
+    other_formatter = logging.Formatter("%(levelname)s - %(message)s")
+
     def format(self, record):
         if record.levelno == logging.INFO:
-            fmt = "%(message)s"
-        else:
-            fmt = "%(levelname)s - %(message)s"
-        formatter = logging.Formatter(fmt)
-        return formatter.format(record)
+            return self.info_formatter.format(record)
+        return self.other_formatter.format(record)
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Format every record as a JSON object on a single line."""
+    def format(self, record):
+        return json.dumps({
+            "time": record.created,
+            "level": record.levelname,
+            "pid": record.process,
+            "thread": record.threadName,
+            "function": record.funcName,
+            "message": record.getMessage(),
+        })
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Let through at most one record every `interval` seconds for each key given as
+    extra={"rate_limit": key}, for messages logged from loops. The next record let through
+    tells how many were dropped. Records without a key are never dropped.
+    """
+    def __init__(self, interval: float = 1.0):
+        super().__init__()
+        self.interval = interval
+        self._last: Dict[str, float] = {}
+        self._dropped: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = getattr(record, "rate_limit", None)
+        if key is None:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last.get(key, float("-inf")) < self.interval:
+                self._dropped[key] = self._dropped.get(key, 0) + 1
+                return False
+            self._last[key] = now
+            dropped = self._dropped.pop(key, 0)
+        if dropped:
+            record.msg = f"{record.msg} ({dropped} similar message(s) suppressed)"
+        return True
+
+
+class TimedSizeRotatingFileHandler(RotatingFileHandler):
+    """
+    Rotate the log when it would go over `maxBytes` or when it was started in a previous
+    `interval` (one day by default, in UTC), whichever comes first.
+    """
+    def __init__(self, filename: str, maxBytes: int, backupCount: int, interval: float = 24 * 3600):
+        super().__init__(filename, maxBytes=maxBytes, backupCount=backupCount)
+        self.interval = interval
+        since = os.path.getmtime(filename) if os.path.exists(filename) else time.time()
+        self.rollover_at = since - since % interval + interval
+
+    def shouldRollover(self, record):
+        if time.time() >= self.rollover_at and os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        now = time.time()
+        self.rollover_at = now - now % self.interval + self.interval
 
 
 formatter = logging.Formatter(format_str)
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# Records are only queued on the calling thread. Formatting, writing and rotating
+# happen in the thread of the listener.
 console_handler = logging.StreamHandler()
-logger.addHandler(console_handler)
 
-file_handler = RotatingFileHandler(
+file_handler = TimedSizeRotatingFileHandler(
     os.path.join(os.path.expanduser(LOG_PATH), 'printer-simulation.log'),
     maxBytes=1024*1024, 
     backupCount=3
 )
 file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
+
+json_handler = None  # JSON lines log, only with --log-json
+queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+queue_handler.addFilter(RateLimitFilter())
+logger.addHandler(queue_handler)
+log_listener = None
+
+
+def _start_log_listener():
+    global log_listener
+    handlers = [console_handler, file_handler] + ([json_handler] if json_handler is not None else [])
+    log_listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    log_listener.start()
+
+
+def flush_logs():
+    """Write every queued record. Logging keeps working afterwards."""
+    if log_listener is not None:
+        log_listener.stop()
+        _start_log_listener()
+
+
+def _restart_log_listener_in_child():
+    # The listener thread does not survive a fork, and records queued by the parent are the parent's to write
+    queue_handler.queue = queue.SimpleQueue()
+    _start_log_listener()
+
+
+def enable_json_log():
+    """Also write the log as JSON lines (printer-simulation.jsonl, next to the plain log)."""
+    global json_handler
+    if json_handler is not None:
+        return
+    json_handler = TimedSizeRotatingFileHandler(
+        os.path.join(os.path.expanduser(LOG_PATH), 'printer-simulation.jsonl'),
+        maxBytes=1024*1024,
+        backupCount=3
+    )
+    json_handler.setFormatter(JsonLinesFormatter())
+    flush_logs()
+
+
+_start_log_listener()
+atexit.register(lambda: log_listener.stop())
+os.register_at_fork(after_in_child=_restart_log_listener_in_child)
+
+
+# Tracing
+
+class Tracer:
+    """
+    Collect timed spans (monotonic clock) of the print jobs and their phases.
+    Spans nest per thread, so a phase inherits the job and the file type of the span that contains it.
+    """
+
+    def __init__(self, jsonl_path: Optional[str] = None, chrome_path: Optional[str] = None):
+        self.jsonl_path = jsonl_path
+        self.chrome_path = chrome_path
+        self.spans: List[dict] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._ids = itertools.count(1)
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attrs):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        parent = stack[-1] if stack else {}
+        record = {
+            "id": next(self._ids),
+            "parent": parent.get("id"),
+            "name": name,
+            "job": attrs.pop("job", parent.get("job")),
+            "file_type": attrs.pop("file_type", parent.get("file_type")),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "attrs": attrs,
+        }
+        stack.append(record)
+        record["start"] = time.monotonic_ns()
+        try:
+            yield record
+        except BaseException as e:
+            record["error"] = type(e).__name__
+            raise
+        finally:
+            record["duration"] = time.monotonic_ns() - record["start"]
+            stack.pop()
+            with self._lock:
+                self.spans.append(record)
+
+    def add(self, name: str, start: int, error: Optional[str] = None, **attrs):
+        """
+        Record a span that started at `start` (time.monotonic_ns()) and ends now, for work spread over
+        several threads or shared by several jobs. `error` is the name of the exception that ended it, if any.
+        """
+        record = {
+            "id": next(self._ids),
+            "parent": None,
+            "name": name,
+            "job": attrs.pop("job", None),
+            "file_type": attrs.pop("file_type", None),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "attrs": attrs,
+            "start": start,
+            "duration": time.monotonic_ns() - start,
+        }
+        if error is not None:
+            record["error"] = error
+        with self._lock:
+            self.spans.append(record)
+
+    def export_jsonl(self, path: str):
+        """Append the spans to `path`, one JSON object per line (times in nanoseconds)."""
+        with open(path, "a", encoding="utf-8") as f:
+            for record in sorted(self.spans, key=lambda r: r["start"]):
+                f.write(json.dumps(record) + "\n")
+
+    def export_chrome(self, path: str):
+        """Write the spans to `path` in Chrome trace event format (chrome://tracing, ui.perfetto.dev)."""
+        events = []
+        for record in sorted(self.spans, key=lambda r: r["start"]):
+            args = dict(record["attrs"], job=record["job"], file_type=record["file_type"])
+            if "error" in record:
+                args["error"] = record["error"]
+            events.append({
+                "name": record["name"],
+                "cat": "job" if record["name"] == "job" else "phase",
+                "ph": "X",
+                "ts": record["start"] / 1000,
+                "dur": record["duration"] / 1000,
+                "pid": record["pid"],
+                "tid": record["tid"],
+                "args": args,
+            })
+        _write_json(path, {"traceEvents": events, "displayTimeUnit": "ms"})
+
+    def summary(self) -> List[str]:
+        """Return the p50/p95/p99 of every phase, and of the whole job per file type, as printable lines."""
+        by_phase: Dict[str, List[float]] = {}
+        by_type: Dict[str, List[float]] = {}
+        for record in self.spans:
+            seconds = record["duration"] / 1e9
+            by_phase.setdefault(record["name"], []).append(seconds)
+            if record["name"] == "job":
+                by_type.setdefault(record["file_type"] or "unknown", []).append(seconds)
+
+        lines = []
+        for title, groups in (("Phase", by_phase), ("File type", by_type)):
+            if not groups:
+                continue
+            lines.append(f"{title:<40} {'n':>5} {'p50':>9} {'p95':>9} {'p99':>9}")
+            for key, values in sorted(groups.items(), key=lambda item: -sum(item[1])):
+                ordered = sorted(values)
+                p50, p95, p99 = (ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in (0.5, 0.95, 0.99))
+                lines.append(f"{key[:40]:<40} {len(values):>5} {p50:>8.2f}s {p95:>8.2f}s {p99:>8.2f}s")
+        return lines
+
+
+def span(name: str, **attrs):
+    """Time a phase of the current job. Does nothing unless tracing is enabled."""
+    if TRACER is None:
+        return contextlib.nullcontext({})
+    return TRACER.span(name, **attrs)
+
+
+def traced(name: str):
+    """Decorator to time every call of a function as the phase `name`."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def finish_tracing():
+    """Export the collected spans and log their summary. Tracing stays off until it is enabled again."""
+    global TRACER
+    tracer, TRACER = TRACER, None
+    if tracer is None or not tracer.spans:
+        return
+    for path, export in ((tracer.jsonl_path, tracer.export_jsonl), (tracer.chrome_path, tracer.export_chrome)):
+        if path:
+            try:
+                export(path)
+                logger.info(f"Trace written to {path}.")
+            except OSError as e:
+                logger.error(f"Could not write the trace to {path}: {e}")
+    logger.info("Timing summary:")
+    for line in tracer.summary():
+        logger.info(f"  {line}")
 
 
 # Dependencies and DISPLAY check
@@ -111,9 +429,101 @@ def _get_active_x11_session():
     return None, None, None
 
 
+def _session_token(display: str, xauthority: str) -> Optional[dict]:
+    """
+    Return a token that changes whenever the graphical session may have changed:
+    a reboot, a new X server (socket inode) or a new Xauthority file.
+    """
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as f:
+            boot_id = f.read().strip()
+        xauth_stat = os.stat(xauthority)
+        x_socket_stat = os.stat(f"/tmp/.X11-unix/X{display.lstrip(':').split('.')[0]}")
+    except OSError:
+        return None
+    return {
+        "boot_id": boot_id,
+        "xauthority": [xauth_stat.st_ino, xauth_stat.st_mtime_ns],
+        "x_socket": x_socket_stat.st_ino,
+    }
+
+
+def _read_trusted_json(path: str) -> Optional[dict]:
+    """
+    Read a JSON file only if it can be trusted: a regular file (not a symlink) owned by root or by
+    the current user, that nobody else can write.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW)
+    except OSError:
+        return None
+    with os.fdopen(fd, encoding="utf-8") as f:
+        st = os.fstat(fd)
+        if not stat.S_ISREG(st.st_mode) or st.st_uid not in (0, os.getuid()) or st.st_mode & 0o022:
+            logger.warning(f"Ignoring {path}: it is not a regular file owned by root or by the current user and writable only by its owner.")
+            return None
+        try:
+            return json.load(f)
+        except ValueError:
+            return None
+
+
+def _read_session_cache() -> Optional[dict]:
+    """Return the published graphical session if its validity token still matches."""
+    cache = _read_trusted_json(SESSION_CACHE_FILE)
+    if not cache or "display" not in cache or "xauthority" not in cache:
+        return None
+    if cache.get("token") != _session_token(cache["display"], cache["xauthority"]):
+        logger.debug("Cached graphical session is no longer valid.")
+        return None
+    return cache
+
+
+def _publish_session_cache(display: str, xauthority: str, user: str):
+    token = _session_token(display, xauthority)
+    if token is None:
+        return
+    try:
+        _write_json(SESSION_CACHE_FILE, {"display": display, "xauthority": xauthority, "user": user, "token": token})
+    except OSError as e:
+        logger.debug(f"Could not publish the graphical session: {e}")
+
+
+def _use_session(session: dict):
+    os.environ["DISPLAY"] = session["display"]
+    os.environ["XAUTHORITY"] = session["xauthority"]
+
+
 def _ensure_graphical_session(timeout=120):
     logger.info("Ensuring graphical session is ready...")
 
+    # Reuse the session published by another process as long as it is still valid
+    session = _read_session_cache()
+    if session is not None:
+        logger.info(f"Graphical session ready for user {session['user']} (cached).")
+        _use_session(session)
+        return
+
+    # Only one process probes logind at a time, the others wait and reuse its result
+    try:
+        lock_fd = os.open(SESSION_CACHE_FILE + ".lock", os.O_RDONLY | os.O_CREAT | os.O_NOFOLLOW, 0o644)
+    except OSError as e:
+        logger.debug(f"Could not open {SESSION_CACHE_FILE}.lock ({e}), probing the graphical session without sharing it.")
+        _probe_graphical_session(timeout)
+        return
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        session = _read_session_cache()
+        if session is not None:
+            logger.info(f"Graphical session ready for user {session['user']} (probed by another process).")
+            _use_session(session)
+            return
+        _probe_graphical_session(timeout)
+    finally:
+        os.close(lock_fd)  # Also releases the lock
+
+
+def _probe_graphical_session(timeout=120):
     start = time.perf_counter()
 
     while time.perf_counter() - start < timeout:
@@ -153,6 +563,7 @@ def _ensure_graphical_session(timeout=120):
             os.environ["XAUTHORITY"] = xauthority
             logger.info("Waiting an additional 1 second to ensure the session is fully ready...")
             time.sleep(1)
+            _publish_session_cache(":0", xauthority, user)
             return
 
         logger.debug("X server not accepting connections yet...")
@@ -164,8 +575,32 @@ def _ensure_graphical_session(timeout=120):
 
 def _check_binary(name: str) -> bool:
     """Check if a binary is installed."""
-    res = subprocess.run(['which', name], capture_output=True, text=True)
-    return res.returncode == 0
+    return shutil.which(name) is not None
+
+
+def _dependency_fingerprint(binaries: List[str]) -> Optional[dict]:
+    """Resolve the binaries in PATH and return a fingerprint (PATH plus binary paths and mtimes), or None if any is missing."""
+    resolved = {}
+    for name in binaries:
+        path = shutil.which(name)
+        if path is None:
+            return None
+        resolved[name] = [path, os.stat(path).st_mtime_ns]
+    return {"path": os.environ.get("PATH", ""), "binaries": resolved}
+
+
+def _cached_dependencies_valid(binaries: List[str]) -> bool:
+    """Check the cached dependency probe: same PATH and every binary still in place with the same mtime."""
+    cache = _read_json(os.path.join(CACHE_PATH, "dependencies.json"))
+    if cache is None or cache.get("path") != os.environ.get("PATH", "") or sorted(cache.get("binaries", {})) != sorted(binaries):
+        return False
+    for path, mtime_ns in cache["binaries"].values():
+        try:
+            if os.stat(path).st_mtime_ns != mtime_ns:
+                return False
+        except OSError:
+            return False
+    return True
 
 
 def _check_python_dependency(name: str) -> bool:
@@ -184,9 +619,19 @@ def _check_and_import_dependencies():
 
         bins_not_installed = []
         python_not_installed = []
-        for bin in binaries:
-            if not _check_binary(bin):
-                bins_not_installed.append(bin)
+        if _cached_dependencies_valid(binaries):
+            logger.debug("Required binaries unchanged since the last check, skipping the PATH lookup.")
+        else:
+            fingerprint = _dependency_fingerprint(binaries)
+            if fingerprint is not None:
+                try:
+                    _write_json(os.path.join(CACHE_PATH, "dependencies.json"), fingerprint)
+                except OSError as e:
+                    logger.debug(f"Could not cache the dependency check: {e}")
+            else:
+                for bin in binaries:
+                    if not _check_binary(bin):
+                        bins_not_installed.append(bin)
         for py_mod in python_modules:
             if not _check_python_dependency(py_mod):
                 python_not_installed.append(py_mod)
@@ -203,8 +648,8 @@ Please install them and try again."""
         # Everything is fine, import the dependencies
         logger.debug("All dependencies are installed.")
 
-        global FileLock
-        from filelock import FileLock
+        global FileLock, Timeout
+        from filelock import FileLock, Timeout
 
         # for mod in python_modules:
         #     globals()[mod] = importlib.import_module(mod)
@@ -237,10 +682,143 @@ Please install them and try again."""
 
 # Lock setup
 
+class TicketLock:
+    """
+    Fair queue in front of a FileLock.
+    Every waiter takes a ticket in a queue file shared by all processes and only the head of the
+    queue (highest priority, then lowest ticket) tries to take the lock, so waiters are served in order.
+    Waiters whose process died are dropped from the queue. Every ticket records the start time of its
+    process, so a ticket is not kept alive by an unrelated process that got the same PID.
+    """
+    HOLD_HISTORY = 20  # Recent hold times kept to estimate the expected wait
+
+    def __init__(self, lock: "FileLock", name: str):
+        self.lock = lock
+        self.name = name
+        self.queue_file = lock.lock_file + ".queue"
+        self.queue_lock = FileLock(lock.lock_file + ".queue.lock")
+
+    @contextlib.contextmanager
+    def _state(self, save: bool = True):
+        """Load the queue state under its own lock and save it back on exit (unless `save` is False)."""
+        with self.queue_lock:
+            state = _read_json(self.queue_file) or {}
+            state.setdefault("next_ticket", 0)
+            state.setdefault("waiting", [])
+            state.setdefault("hold_times", [])
+            state["waiting"] = [w for w in state["waiting"] if _waiter_alive(w)]
+            yield state
+            if save:
+                _write_json(self.queue_file, state)
+
+    def _position(self, state: dict, ticket: int) -> int:
+        order = sorted(state["waiting"], key=lambda w: (-w["priority"], w["ticket"]))
+        return next(i for i, w in enumerate(order) if w["ticket"] == ticket)
+
+    def _expected_wait(self, state: dict, position: int) -> Optional[float]:
+        if not state["hold_times"]:
+            return None
+        average = sum(state["hold_times"]) / len(state["hold_times"])
+        holder = state.get("holder")
+        remaining = max(0.0, average - (time.time() - holder["since"])) if holder else 0.0
+        return remaining + position * average
+
+    def status(self) -> List[dict]:
+        """Return the waiters in the order they will be served."""
+        with self._state(save=False) as state:
+            return sorted(state["waiting"], key=lambda w: (-w["priority"], w["ticket"]))
+
+    @contextlib.contextmanager
+    def acquire(self, timeout: Optional[float] = None, priority: int = 0):
+        """
+        Wait for our turn and hold the lock. Raises Timeout if it is not acquired within `timeout`
+        seconds (None waits forever, 0 is a single try).
+        """
+        start = time.monotonic()
+        with self._state() as state:
+            ticket = state["next_ticket"]
+            state["next_ticket"] += 1
+            state["waiting"].append({
+                "ticket": ticket, "pid": os.getpid(), "start": _process_start_time(os.getpid()),
+                "priority": priority, "since": time.time()
+            })
+
+        acquired = False
+        last_position = None
+        try:
+            while True:
+                with self._state(save=False) as state:
+                    position = self._position(state, ticket)
+                if position != last_position:
+                    expected = self._expected_wait(state, position)
+                    expected_str = f", expected wait {expected:.1f} seconds" if expected is not None else ""
+                    logger.debug(
+                        f"Waiting for the {self.name} lock: position {position + 1} in the queue{expected_str}.",
+                        extra={"rate_limit": f"lock-{self.name}"}
+                    )
+                    last_position = position
+
+                remaining = None if timeout is None else timeout - (time.monotonic() - start)
+                if position == 0:
+                    # Head of the queue: block on the lock itself, so the handoff happens as soon as it is released
+                    try:
+                        self.lock.acquire(timeout=0.5 if remaining is None else max(0.0, min(remaining, 0.5)), poll_interval=0.01)
+                        acquired = True
+                        break
+                    except Timeout:
+                        pass
+                if timeout is not None and time.monotonic() - start >= timeout:
+                    raise Timeout(self.lock.lock_file)
+                if position != 0:
+                    sleep(0.1)
+
+            with self._state() as state:
+                state["waiting"] = [w for w in state["waiting"] if w["ticket"] != ticket]
+                state["holder"] = {"pid": os.getpid(), "since": time.time()}
+        except BaseException:
+            with self._state() as state:
+                state["waiting"] = [w for w in state["waiting"] if w["ticket"] != ticket]
+            if acquired:
+                self.lock.release()
+            raise
+
+        held_since = time.monotonic()
+        try:
+            yield self
+        finally:
+            with self._state() as state:
+                state["hold_times"] = (state["hold_times"] + [time.monotonic() - held_since])[-self.HOLD_HISTORY:]
+                state.pop("holder", None)
+            self.lock.release()
+
+
+def _process_start_time(pid: int) -> Optional[int]:
+    """Return the start time of a process (in clock ticks since boot), or None if it does not exist."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            proc_stat = f.read()
+    except OSError:
+        return None
+    # The command name (2nd field) may contain spaces and parentheses, the fields after it do not
+    return int(proc_stat.rsplit(")", 1)[1].split()[19])
+
+
+def _waiter_alive(waiter: dict) -> bool:
+    """Whether the process that took a ticket is still running. Tickets without a start time are stale."""
+    start = waiter.get("start")
+    return start is not None and _process_start_time(waiter["pid"]) == start
+
+
 def _setup_locks():
-    global LOCK, LOCK_INPUT
-    LOCK = FileLock(os.path.join("/", "opt", "locks", ".printer.lock"))
-    LOCK_INPUT = FileLock(os.path.join("/", "opt", "locks", ".input.lock"))
+    global LOCK, LOCK_INPUT, LOCK_QUEUE, LOCK_INPUT_QUEUE
+    with contextlib.suppress(OSError):
+        lock_dir_mode = os.stat(LOCK_DIR).st_mode
+        if lock_dir_mode & 0o002 and not lock_dir_mode & stat.S_ISVTX:
+            logger.warning(f"{LOCK_DIR} is writable by every user but has no sticky bit: other users can replace the lock and session files in it.")
+    LOCK = FileLock(os.path.join(LOCK_DIR, ".printer.lock"))
+    LOCK_INPUT = FileLock(os.path.join(LOCK_DIR, ".input.lock"))
+    LOCK_QUEUE = TicketLock(LOCK, "printer")
+    LOCK_INPUT_QUEUE = TicketLock(LOCK_INPUT, "input")
 
 
 # Input simulation functions
@@ -252,23 +830,136 @@ def _set_env():
     return env
 
 
+def _input_simulation_entry_point() -> Optional["importlib.metadata.EntryPoint"]:
+    """Return the console entry point of input-simulation if it is installed as a Python package."""
+    import importlib.metadata  # Slow to import, only needed when the input worker is started
+    for entry_point in importlib.metadata.entry_points(group='console_scripts'):
+        if entry_point.name == 'input-simulation':
+            return entry_point
+    return None
+
+
+def _input_worker_main():
+    """
+    Serve input-simulation requests in this process, one JSON object per line on stdin.
+    Each request is {"argv": [...]} and gets a {"rc": <exit code>} line back.
+    """
+    reply = os.fdopen(os.dup(1), 'w', buffering=1)
+    os.dup2(2, 1)  # Keep input-simulation's own output away from the reply channel
+
+    entry_point = _input_simulation_entry_point()
+    if entry_point is None:
+        logger.error("input-simulation is not installed as a Python package, the input worker cannot run.")
+        exit(1)
+    run = entry_point.load()
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        sys.argv = ['input-simulation'] + request['argv']
+        rc = 0
+        try:
+            run()
+        except SystemExit as e:
+            rc = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except Exception as e:
+            logger.error(f"input-simulation failed inside the input worker: {e}")
+            rc = 1
+        reply.write(json.dumps({'rc': rc}) + '\n')
+
+
+class InputSimulationSession:
+    """
+    Long-lived input-simulation worker fed through a pipe.
+    It is started once per run, so the interpreter and input-simulation startup (including
+    its X connection) are paid once instead of once per keyboard sequence.
+    """
+    def __init__(self):
+        self.proc: Optional[subprocess.Popen] = None
+
+    def start(self):
+        if getattr(sys, 'frozen', False):
+            command = [sys.executable, '--input-worker']
+        else:
+            command = [sys.executable, os.path.abspath(__file__), '--input-worker']
+        self.proc = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env=_set_env(),  # The worker only lives while the input lock is held
+            text=True,
+            bufsize=1
+        )
+        logger.debug(f"Input-simulation worker started (PID: {self.proc.pid}).")
+
+    def is_alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def run(self, argv: List[str]) -> int:
+        """Send a command line to the worker and wait for it to finish."""
+        self.proc.stdin.write(json.dumps({'argv': argv}) + '\n')
+        self.proc.stdin.flush()
+        line = self.proc.stdout.readline()
+        if not line:
+            raise BrokenPipeError("input-simulation worker exited unexpectedly.")
+        return json.loads(line)['rc']
+
+    def close(self):
+        if self.proc is None:
+            return
+        try:
+            self.proc.stdin.close()
+            self.proc.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self.proc.kill()
+            self.proc.wait()
+        logger.debug(f"Input-simulation worker stopped (PID: {self.proc.pid}).")
+        self.proc = None
+
+
+def start_input_session():
+    """Start the persistent input-simulation worker if input-simulation can be run in-process."""
+    global INPUT_SESSION
+    if INPUT_SESSION is not None and INPUT_SESSION.is_alive():
+        return
+    if _input_simulation_entry_point() is None:
+        logger.debug("input-simulation is not importable, using one process per input sequence.")
+        return
+    INPUT_SESSION = InputSimulationSession()
+    INPUT_SESSION.start()
+
+
+def stop_input_session():
+    global INPUT_SESSION
+    if INPUT_SESSION is not None:
+        INPUT_SESSION.close()
+        INPUT_SESSION = None
+
+
 def input_simulation(sequence: List[str], verb: str, args: Optional[dict] = None, debug: bool = False):
     """Simulate a sequence of inputs using input-simulation."""
-    env = _set_env()
-
     # Convert args dict to a list of command line arguments
     args_l = [f"{key}={value}" if value else f"{key}" for key, value in args.items()] if args is not None else []
     if debug:
         args_l.append('--debug')
     sequence_string = ' '.join(sequence)
 
-    if args_l:
-        command = ['input-simulation', verb] + args_l + [f"{sequence_string}"]
-    else:
-        command = ['input-simulation', verb, f"{sequence_string}"]
+    argv = [verb] + args_l + [f"{sequence_string}"]
     logger.debug(f"Invoking input-simulation command with verb '{verb}', args: {args_l} and sequence (truncated at 50): {sequence_string[:50]}...")
-    subprocess.run(command, env=env)
-    logger.debug("Returned from input-simulation.")
+
+    with span("input", verb=verb):
+        if INPUT_SESSION is not None and INPUT_SESSION.is_alive():
+            try:
+                rc = INPUT_SESSION.run(argv)
+                logger.debug(f"Returned from input-simulation worker (return code {rc}).")
+                return
+            except (OSError, ValueError) as e:
+                logger.warning(f"input-simulation worker failed ({e}), falling back to a new process.")
+                stop_input_session()
+
+        subprocess.run(['input-simulation'] + argv, env=_set_env())
+        logger.debug("Returned from input-simulation.")
 
 
 def input_key(key: str, presses: int = 1, args: Optional[dict] = None, debug: bool = False):
@@ -295,6 +986,11 @@ def input_sequence(sequence: List[str], args: Optional[dict] = None, debug: bool
 
 # Auxiliary functions
 
+def _proc_program(proc: subprocess.Popen) -> str:
+    """Name of the program run by a subprocess.Popen object."""
+    return os.path.basename(proc.args[0] if isinstance(proc.args, list) else str(proc.args).split()[0])
+
+
 def proc_to_str(proc: subprocess.Popen) -> str:
     """Convert a subprocess.Popen object to a string for logging."""
     if isinstance(proc.args, list):
@@ -304,21 +1000,163 @@ def proc_to_str(proc: subprocess.Popen) -> str:
     return cmd
 
 
-def close_failsafe(proc: subprocess.Popen):
-    """Failsafe to close a proc if something goes wrong."""
-    sleep(2)
-    proc_name = f"'{proc_to_str(proc)}'"
-    if proc.poll() is None:  # If the process is still running
-        logger.debug(f"{proc_name} process (PID: {proc.pid}) is still running, terminating it (SIGTERM).")
-        proc.terminate()
-        
-        try:
-            proc.wait(timeout=5)  # Wait for the process to terminate gracefully
-            logger.debug(f"{proc_name} process terminated gracefully.")
-        except subprocess.TimeoutExpired:
+class ProcessReaper:
+    """
+    Close launched programs in the background. Each one gets a grace period to exit on its own
+    (e.g. after Alt+F4), then SIGTERM, and SIGKILL if it is still alive after the termination timeout.
+    A thread sleeps on the pidfds of the processes (or polls them where pidfd_open is not available),
+    so the print flow never waits for a teardown.
+    A command that has already exited may have left its window in a running instance of the program
+    (e.g. with --reuse-apps): that window is closed by ID (wmctrl -ic) after the grace period instead.
+    """
+    WINDOW_POLL_INTERVAL = 0.5  # Seconds between checks of the windows being closed
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[object, dict] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+
+    def reap(self, proc: subprocess.Popen, wid: Optional[int] = None, grace: float = 2.0, term_timeout: float = 5.0):
+        pidfd = None
+        if proc.poll() is not None:
+            if wid is None:
+                return
+            key = ("window", wid)
+            proc = None
+        else:
+            key = proc.pid
+            if hasattr(os, "pidfd_open"):
+                try:
+                    pidfd = os.pidfd_open(key)
+                except OSError:
+                    pass
+        now = time.monotonic()
+        entry = {
+            "key": key, "proc": proc, "wid": wid, "pidfd": pidfd, "term_at": now + grace,
+            "kill_at": now + grace + term_timeout, "stage": 0, "exited": threading.Event()
+        }
+        with self._lock:
+            self._entries[key] = entry
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="process-reaper", daemon=True)
+                self._thread.start()
+        os.write(self._wakeup_w, b"x")
+
+    def windows(self) -> frozenset:
+        """Windows of the programs being closed, which must not be mistaken for new ones."""
+        with self._lock:
+            return frozenset(e["wid"] for e in self._entries.values() if e["wid"] is not None)
+
+    def finish(self, program: str, term_timeout: float = 5.0):
+        """
+        Terminate now the processes of `program` being closed and wait for them to exit.
+        firefox, eog, gedit and LibreOffice hand a new document to their running process, so
+        one that is being closed would take the next document with it.
+        """
+        with self._lock:
+            now = time.monotonic()
+            entries = [e for e in self._entries.values() if e["proc"] is not None and _proc_program(e["proc"]) == program]
+            for entry in entries:
+                entry["term_at"] = min(entry["term_at"], now)
+                entry["kill_at"] = min(entry["kill_at"], now + term_timeout)
+        if not entries:
+            return
+        logger.debug(f"Waiting for {len(entries)} {program} process(es) being closed to exit.")
+        os.write(self._wakeup_w, b"x")
+        for entry in entries:
+            entry["exited"].wait(term_timeout + 5)
+
+    def _step_window(self, entry: dict, now: float) -> bool:
+        """Move a window left by an exited command along its teardown. Returns True once it is gone."""
+        wid = entry["wid"]
+        if wid not in {w for w, _ in list_windows()}:
+            logger.debug(f"Window {hex(wid)} closed.")
+            return True
+        if now >= entry["kill_at"]:
+            logger.warning(f"Window {hex(wid)} could not be closed, leaving it open.")
+            return True
+        if entry["stage"] < 1 and now >= entry["term_at"]:
+            logger.debug(f"Window {hex(wid)} is still open, closing it (wmctrl -ic).")
+            subprocess.run(["wmctrl", "-ic", hex(wid)])
+            entry["stage"] = 1
+        return False
+
+    def _step(self, entry: dict, now: float) -> bool:
+        """Move a process along its teardown. Returns True once it has exited."""
+        if entry["proc"] is None:
+            return self._step_window(entry, now)
+        proc = entry["proc"]
+        proc_name = f"'{proc_to_str(proc)}'"
+        if proc.poll() is not None:
+            logger.debug(f"{proc_name} process (PID: {proc.pid}) exited with code {proc.returncode}.")
+            return True
+        if entry["stage"] < 2 and now >= entry["kill_at"]:
             logger.debug(f"{proc_name} process did not terminate, killing it (SIGKILL).")
             proc.kill()
-            proc.wait()
+            entry["stage"] = 2
+        elif entry["stage"] < 1 and now >= entry["term_at"]:
+            logger.debug(f"{proc_name} process (PID: {proc.pid}) is still running, terminating it (SIGTERM).")
+            proc.terminate()
+            entry["stage"] = 1
+        return False
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._entries:
+                    self._thread = None
+                    return
+                entries = list(self._entries.values())
+            deadlines = [e["kill_at"] if e["stage"] == 1 else e["term_at"] for e in entries if e["stage"] < 2]
+            timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else 0.1
+            fds = [e["pidfd"] for e in entries if e["pidfd"] is not None]
+            if any(e["proc"] is None for e in entries):
+                timeout = min(timeout, self.WINDOW_POLL_INTERVAL)  # Windows can only be checked by listing them
+            if len(fds) < len([e for e in entries if e["proc"] is not None]) or any(e["stage"] == 2 for e in entries):
+                timeout = min(timeout, 0.1)  # Without a pidfd, the exit can only be noticed by polling
+            select.select(fds + [self._wakeup_r], [], [], timeout)
+            try:
+                os.read(self._wakeup_r, 4096)
+            except BlockingIOError:
+                pass
+
+            now = time.monotonic()
+            for entry in entries:
+                if self._step(entry, now):
+                    with self._lock:
+                        self._entries.pop(entry["key"], None)
+                    if entry["pidfd"] is not None:
+                        os.close(entry["pidfd"])
+                    entry["exited"].set()
+
+    def shutdown(self, term_timeout: float = 5.0):
+        """Tear down every outstanding process in parallel: SIGTERM now, SIGKILL after `term_timeout` seconds."""
+        with self._lock:
+            if not self._entries:
+                return
+            now = time.monotonic()
+            for entry in self._entries.values():
+                entry["term_at"] = min(entry["term_at"], now)
+                entry["kill_at"] = min(entry["kill_at"], now + term_timeout)
+            thread = self._thread
+            logger.debug(f"Closing {len(self._entries)} outstanding process(es).")
+        os.write(self._wakeup_w, b"x")
+        if thread is not None:
+            thread.join(term_timeout + 5)
+
+
+REAPER = ProcessReaper()
+
+
+@traced("close")
+def close_failsafe(proc: subprocess.Popen, wid: Optional[int] = None):
+    """
+    Failsafe to close a proc if something goes wrong. Returns immediately: the process is given
+    2 seconds to exit and then terminated in the background by REAPER.
+    """
+    REAPER.reap(proc, wid)
 
 
 def get_system():
@@ -328,15 +1166,153 @@ def get_system():
         return 'Linux'
     
 
-def wait_for_program(program: str, pid: Optional[int] = None):
-    logger.debug(f"Waiting for {program} to load.")
-    while True:
-        result = subprocess.run(['wmctrl', '-l'], capture_output=True, text=True)
-        if program in result.stdout:
-            logger.debug(f"{program} (PID: {pid}) is loaded.")
-            break
-        sleep(1)  # Wait for 1 second before checking again
-    sleep(2)  # Fail-safe sleep to ensure the program is fully loaded
+def list_windows() -> List[Tuple[int, str]]:
+    """Return (window id, title) pairs for the current client windows using wmctrl."""
+    result = subprocess.run(['wmctrl', '-l'], capture_output=True, text=True)
+    windows = []
+    for line in result.stdout.splitlines():
+        parts = line.split(None, 3)
+        if len(parts) < 3:
+            continue
+        title = parts[3] if len(parts) == 4 else ""
+        try:
+            windows.append((int(parts[0], 16), title))
+        except ValueError:
+            continue
+    return windows
+
+
+def _find_window_wmctrl(program: str, exclude: frozenset = frozenset()) -> Optional[int]:
+    for wid, title in list_windows():
+        if program in title and wid not in exclude:
+            return wid
+    return None
+
+
+def _wait_for_window_xlib(program: str, deadline: float, exclude: frozenset = frozenset()) -> Optional[int]:
+    """
+    Wait for a mapped window whose title contains `program` using X11 events.
+    Listens to _NET_CLIENT_LIST changes on the root window and to title and map
+    changes on every client window, so it wakes up as soon as something relevant happens.
+    """
+    from Xlib import X, display as xdisplay  # Optional dependency (python-xlib)
+
+    disp = xdisplay.Display()
+    try:
+        root = disp.screen().root
+        net_client_list = disp.intern_atom('_NET_CLIENT_LIST')
+        net_wm_name = disp.intern_atom('_NET_WM_NAME')
+        utf8_string = disp.intern_atom('UTF8_STRING')
+        root.change_attributes(event_mask=X.PropertyChangeMask)
+        watched = set()
+
+        def check() -> Optional[int]:
+            prop = root.get_full_property(net_client_list, X.AnyPropertyType)
+            for wid in (prop.value if prop else []):
+                if wid in exclude:
+                    continue
+                window = disp.create_resource_object('window', wid)
+                try:
+                    if wid not in watched:
+                        window.change_attributes(event_mask=X.PropertyChangeMask | X.StructureNotifyMask)
+                        watched.add(wid)
+                    name = window.get_full_property(net_wm_name, utf8_string)
+                    title = name.value.decode('utf-8', 'replace') if name else (window.get_wm_name() or "")
+                    if isinstance(title, bytes):
+                        title = title.decode('utf-8', 'replace')
+                    if program in title and window.get_attributes().map_state == X.IsViewable:
+                        return wid
+                except Exception:  # The window may vanish between listing and querying it
+                    continue
+            return None
+
+        wid = check()
+        while wid is None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            # Block until the X connection has events or the deadline expires
+            select.select([disp.fileno()], [], [], remaining)
+            relevant = False
+            while disp.pending_events():
+                event = disp.next_event()
+                if event.type in (X.PropertyNotify, X.MapNotify, X.CreateNotify, X.DestroyNotify):
+                    relevant = True
+            if relevant:
+                wid = check()
+        return wid
+    finally:
+        disp.close()
+
+
+def _wait_for_window_xprop(program: str, deadline: float, recheck_interval: float = 0.5, exclude: frozenset = frozenset()) -> Optional[int]:
+    """
+    Wait for a window whose title contains `program` by following root window property
+    changes (_NET_CLIENT_LIST, _NET_ACTIVE_WINDOW) with `xprop -spy`. Title changes are
+    not reported on the root window, so the window list is also rechecked every `recheck_interval` seconds.
+    """
+    spy = subprocess.Popen(
+        ['xprop', '-root', '-spy', '_NET_CLIENT_LIST', '_NET_ACTIVE_WINDOW'],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        wid = _find_window_wmctrl(program, exclude)
+        while wid is None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            ready, _, _ = select.select([spy.stdout], [], [], min(remaining, recheck_interval))
+            if ready and not os.read(spy.stdout.fileno(), 4096):
+                # xprop exited, keep going with the plain recheck interval
+                spy.wait()
+                sleep(min(max(deadline - time.monotonic(), 0), recheck_interval))
+            wid = _find_window_wmctrl(program, exclude)
+        return wid
+    finally:
+        if spy.poll() is None:
+            spy.terminate()
+            spy.wait()
+
+
+@traced("wait_for_program")
+def wait_for_program(
+        program: str,
+        pid: Optional[int] = None,
+        timeout: Optional[float] = None,
+        exclude: Optional[set] = None
+    ) -> int:
+    """
+    Wait until a window whose title contains `program` is mapped and return its window ID.
+    Windows in `exclude`, the windows kept open by reused application instances and the windows
+    of the programs being closed are ignored.
+    Raises TimeoutError if it does not appear within `timeout` seconds (WINDOW_WAIT_TIMEOUT by default).
+    """
+    timeout = WINDOW_WAIT_TIMEOUT if timeout is None else timeout
+    exclude = frozenset(exclude or ()) | _app_instance_windows() | REAPER.windows()
+    logger.debug(f"Waiting for {program} to load (timeout: {timeout} seconds).")
+    start = time.monotonic()
+    deadline = start + timeout
+
+    if importlib.util.find_spec("Xlib") is not None and os.environ.get("DISPLAY"):
+        wid = _wait_for_window_xlib(program, deadline, exclude)
+    elif shutil.which('xprop'):
+        wid = _wait_for_window_xprop(program, deadline, exclude=exclude)
+    else:
+        wid = _find_window_wmctrl(program, exclude)
+        while wid is None and time.monotonic() < deadline:
+            sleep(0.5)
+            wid = _find_window_wmctrl(program, exclude)
+
+    waited = time.monotonic() - start
+    if wid is None:
+        logger.error(f"{program} (PID: {pid}) did not show up after {waited:.2f} seconds.")
+        raise TimeoutError(f"Timeout waiting for {program} to load.")
+
+    logger.debug(f"{program} (PID: {pid}, window: {hex(wid)}) is loaded after {waited:.2f} seconds.")
+    if WINDOW_SETTLE_DELAY > 0:
+        sleep(WINDOW_SETTLE_DELAY)  # Optional fail-safe sleep to let the program finish drawing
+    return wid
 
 
 def sleep_action(delay: Union[float, Tuple[float, float]], extra_delay: float = 0.0):
@@ -378,275 +1354,1732 @@ def process_output(file: str, output: Optional[str] = None) -> str:
     return output_file
 
 
-def get_random_file_from_dir(dir: str) -> Optional[str]:
-    logger.info(f"Getting a random file from directory {dir}.")
-    files = [f for f in os.listdir(dir) if not os.path.isdir(f)]
-    if not files:
-        logger.info(f"No files found in {dir}.")
-        return None
-    
-    random_file = os.path.abspath(
-        os.path.join(
-            dir, 
-            random.choice(files)
-        )
-    )
-    logger.info(f"Random file chosen: {random_file}.")
-    
-    return os.path.join(dir, random_file)
-
+LIBREOFFICE_MIME_TYPES = [
+    'application/vnd.oasis.opendocument.text',
+    'application/vnd.oasis.opendocument.spreadsheet',
+    'application/vnd.oasis.opendocument.presentation',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation'
+]
 
-# Windows printing functions (not implemented yet)
 
-def print_in_windows(
-        visible: bool, 
-        files: List[str],
-        min_delay: float,
-        max_delay: float,
-        delay: float,
-        output: Optional[str]
-    ):
-    pass
+# File classification (in-process replacement of xdg-mime)
 
+_MIME_TABLES = None
+_MIME_CACHE = None
+_MIME_CACHE_LOCK = threading.Lock()
+_MAGIC_SIGNATURES = [
+    (b"%PDF-", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+    (b"{\\rtf", "application/rtf"),
+    (b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "application/x-ole-storage"),
+]
 
-# Linux printing functions
 
+def _xdg_dirs(home_var: str, home_default: str, dirs_var: str, dirs_default: str) -> List[str]:
+    """Return the XDG base directories for a kind of data, in precedence order."""
+    home = os.environ.get(home_var) or os.path.join(os.path.expanduser('~'), home_default)
+    return [home] + [d for d in (os.environ.get(dirs_var) or dirs_default).split(":") if d]
 
-def start_print_process_visually(
-        file: str, 
-        output: Optional[str],
-        is_libreoffice: bool = False,
-        is_firefox: bool = False,
-        debug: bool = False
-    ) -> str:
-    # Start the print dialog
-    logger.debug(f"Starting the print dialog for {file}.")
-    sleep(2)
-    input_key('Ctrl+P', debug=debug)
-    sleep(3)
 
-    # Go to the printers list
-    logger.debug("Selecting the printer.")
-    args = {
-        "--press-interval": 0.5,
-        "--typing-interval": 0.2,
-        "--sleep": 1.0
-    }
-    if is_libreoffice:
-        sequence = [
-            'K,Shift+Tab,5',  # Go to the print option
-            'K,Space',  # Select the print option
-            'T,"imprimir"',  # Change the printer to print to a file
-            'S,0.0',
-            'K,Enter,2'  # Select the printer
-        ]
-    elif is_firefox:
-        sequence = [
-            'K,Tab,5',  # Go to the print option
-            'K,Enter',  # Select the print option
-            'K,Tab',  # Go to the list of printers
-            'T,"imprimir"',  # Change the printer to print to a file
-            'S,0.0',
-            'K,Tab,2',  # Select the filename field,
-            'S,0.0',
-            'K,Enter'  # Press Enter to write the filename
-        ]
-    else:
-        sequence = [
-            'K,Tab,1',  # Go to the printer text field
-            'T,"imprimir"',  # Write "imprimir" to ensure the right printer is selected
-            'S,0.0',
-            'K,Tab,2',  # Go to the filename field
-            'K,Enter'  # Press Enter to write the filename
-        ]
-    input_keyboard_sequence(sequence, args, debug)
-        
-    # Write the filename
-    # Check the output (is it a directory or a filename?)
-    output_file = process_output(file, output)
+def _load_mime_tables() -> Tuple[Dict[str, str], Dict[str, str]]:
+    """
+    Parse the shared-mime-info globs and the default applications once.
+    Returns (extension -> MIME type, MIME type -> default .desktop file).
+    """
+    import configparser
+    extensions: Dict[str, str] = {}
+    data_dirs = _xdg_dirs("XDG_DATA_HOME", ".local/share", "XDG_DATA_DIRS", "/usr/local/share:/usr/share")
+    for data_dir in reversed(data_dirs):  # Later (more important) directories override earlier ones
+        try:
+            with open(os.path.join(data_dir, "mime", "globs2"), encoding="utf-8") as f:
+                weighted = {}
+                for line in f:
+                    parts = line.strip().split(":")
+                    if len(parts) < 3 or line.startswith("#") or not parts[2].startswith("*."):
+                        continue
+                    ext = parts[2][1:].lower()
+                    if "*" in ext or "[" in ext or int(parts[0]) < weighted.get(ext, 0):
+                        continue
+                    weighted[ext] = int(parts[0])
+                    extensions[ext] = parts[1]
+        except (OSError, ValueError):
+            continue
 
-    sequence = [
-        'K,Ctrl+A',  # Select all text
-        'S,0.0',
-        f'T,"{output_file}"',  # Type the filename
-        'S,1.0',
-        'K,Enter',  # Select the filename
-        'S,1.0',
+    # mimeapps.list files in precedence order, then the mimeinfo.cache of the installed applications
+    desktops = [d.lower() for d in os.environ.get("XDG_CURRENT_DESKTOP", "").split(":") if d]
+    config_dirs = _xdg_dirs("XDG_CONFIG_HOME", ".config", "XDG_CONFIG_DIRS", "/etc/xdg")
+    app_dirs = [os.path.join(d, "applications") for d in data_dirs]
+    mimeapps_files = [
+        os.path.join(d, f"{prefix}mimeapps.list")
+        for d in config_dirs + app_dirs
+        for prefix in [f"{desktop}-" for desktop in desktops] + [""]
     ]
-    input_keyboard_sequence(sequence, args, debug)
+    defaults: Dict[str, str] = {}
+    for path, section in [(p, "Default Applications") for p in mimeapps_files] + [(os.path.join(d, "mimeinfo.cache"), "MIME Cache") for d in app_dirs]:
+        parser = configparser.ConfigParser(interpolation=None, strict=False, delimiters=("=",))
+        parser.optionxform = str  # MIME types are case sensitive
+        try:
+            parser.read(path, encoding="utf-8")
+        except (configparser.Error, UnicodeDecodeError):
+            continue
+        if not parser.has_section(section):
+            continue
+        for mime_type, apps in parser.items(section):
+            app = next((a for a in apps.split(";") if a), None)
+            if app and mime_type not in defaults:
+                defaults[mime_type] = app
+    return extensions, defaults
 
-    if is_libreoffice:
-        # These are needed in case of confirmation dialog on an existing file
-        proc = subprocess.run(['wmctrl', '-lx'], capture_output=True, text=True)
-        save_windows_before = [line for line in proc.stdout.splitlines() if 'soffice.Soffice' in line]
-        sequence = [
-            'K,Tab',
-            'K,Enter',
-            # 'K,Ctrl+Z,2'  # Needed to undo in case of printing a text file
-        ]
-        proc = subprocess.run(['wmctrl', '-lx'], capture_output=True, text=True)
-        save_windows_after = [line for line in proc.stdout.splitlines() if 'soffice.Soffice' in line]
-        if len(save_windows_after) > len(save_windows_before):
-            logger.debug("Confirmation dialog detected, confirming overwrite.")
-            sequence = [
-                'K,Tab',
-                'K,Enter'
-            ]
-            input_keyboard_sequence(sequence, args, debug)
-    if not is_libreoffice:
-        sequence = [
-            'K,Shift+Tab,3',  # Go to the "Print" button
-            'K,Enter,2',  # Two presses in case of confirmation dialog of an existing file
-            'K,Ctrl+Z'  # Needed to undo in case of printing a text file
-        ]
-    input_keyboard_sequence(sequence, args, debug)
-    sleep(1)
 
-    return output_file
+def _sniff_mime_type(file: str) -> Optional[str]:
+    """Guess the MIME type of a file from its first bytes."""
+    try:
+        with open(file, "rb") as f:
+            head = f.read(4096)
+    except OSError:
+        return None
+    if not head:
+        return "application/x-zerosize"
+    for signature, mime_type in _MAGIC_SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    if head.startswith(b"RIFF") and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head.startswith(b"PK\x03\x04"):
+        # OpenDocument stores its MIME type uncompressed as the first entry of the archive
+        if head[30:38] == b"mimetype":
+            return head[38:head.find(b"PK", 38)].decode("ascii", "replace").strip() or "application/zip"
+        import zipfile
+        try:
+            with zipfile.ZipFile(file) as archive:
+                names = archive.namelist()
+        except (zipfile.BadZipFile, OSError):
+            return "application/zip"
+        for prefix, mime_type in [("word/", LIBREOFFICE_MIME_TYPES[3]), ("xl/", LIBREOFFICE_MIME_TYPES[4]), ("ppt/", LIBREOFFICE_MIME_TYPES[5])]:
+            if any(name.startswith(prefix) for name in names):
+                return mime_type
+        return "application/zip"
+    if b"\x00" not in head:
+        try:
+            head.decode("utf-8")
+            return "text/plain"
+        except UnicodeDecodeError as e:
+            if e.start >= len(head) - 3:  # A multi-byte character cut at the end of the buffer
+                return "text/plain"
+    return None
+
+
+def classify_mime_type(file: str) -> str:
+    """Return the MIME type of a file from its extension, or from its contents when the extension is unknown."""
+    global _MIME_TABLES
+    if _MIME_TABLES is None:
+        _MIME_TABLES = _load_mime_tables()
+    extensions, _ = _MIME_TABLES
+
+    name = os.path.basename(file).lower()
+    suffixes = name.split(".")[1:]
+    # Longest extension first, e.g. ".tar.gz" before ".gz"
+    guessed = None
+    for i in range(len(suffixes)):
+        ext = "." + ".".join(suffixes[i:])
+        if ext in extensions:
+            guessed = extensions[ext]
+            break
+    else:
+        guessed, _ = mimetypes.guess_type(name, strict=False)
+    if guessed and guessed != "application/octet-stream":
+        return guessed
+    return _sniff_mime_type(file) or "application/octet-stream"
 
 
+def _load_mime_cache() -> Dict[str, list]:
+    try:
+        with open(os.path.join(CACHE_PATH, "mime-cache.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-def print_image_linux(file: str, output: Optional[str], debug: bool = False):
-    dir_path = os.path.dirname(os.path.abspath(os.path.expanduser(file)))
-    
-    global FILE_PROGRAM_PROC
-    FILE_PROGRAM_PROC = subprocess.Popen(["eog", file], cwd=dir_path)
-    logger.info(f"Priting image {file}...")
-    # In case of eog, the program name is the name of the file (just the last part)
-    program_name = os.path.basename(file)
-    wait_for_program(program_name, pid=FILE_PROGRAM_PROC.pid)
 
-    output_file = start_print_process_visually(file, output, debug=debug)
+def save_mime_cache():
+    """Write the classification cache to disk so the next runs can reuse it."""
+    with _MIME_CACHE_LOCK:
+        if not _MIME_CACHE:
+            return
+        entries = list(_MIME_CACHE.items())[-MIME_CACHE_MAX_ENTRIES:]
+    try:
+        os.makedirs(CACHE_PATH, exist_ok=True)
+        tmp_file = os.path.join(CACHE_PATH, f"mime-cache.json.{os.getpid()}")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(dict(entries), f)
+        os.replace(tmp_file, os.path.join(CACHE_PATH, "mime-cache.json"))
+    except OSError as e:
+        logger.debug(f"Could not save the MIME cache: {e}")
 
-    return output_file, program_name
 
+def get_mime_info(file: str) -> Tuple[str, str]:
+    """
+    Return the MIME type of a file and the default program that opens it.
+    The MIME type is cached on disk by (path, size, mtime) and reused across runs.
+    """
+    global _MIME_CACHE, _MIME_TABLES
+    with _MIME_CACHE_LOCK:
+        if _MIME_CACHE is None:
+            _MIME_CACHE = _load_mime_cache()
+        if _MIME_TABLES is None:
+            _MIME_TABLES = _load_mime_tables()
 
-def print_text_linux(file: str, output: Optional[str], debug: bool = False):
-    global FILE_PROGRAM_PROC
-    FILE_PROGRAM_PROC = subprocess.Popen(["gedit", file])
-    logger.info(f"Priting text file {file}...")
-    program_name = "gedit"
-    wait_for_program(program_name, pid=FILE_PROGRAM_PROC.pid)
+    try:
+        st = os.stat(file)
+        key = [st.st_size, st.st_mtime_ns]
+    except OSError:
+        key = None
+
+    with _MIME_CACHE_LOCK:
+        cached = _MIME_CACHE.get(file)
+    if key is not None and cached is not None and cached[:2] == key:
+        mime_type = cached[2]
+    else:
+        mime_type = classify_mime_type(file)
+        if mime_type == "application/octet-stream" and shutil.which("xdg-mime"):
+            mime_type = subprocess.run(['xdg-mime', 'query', 'filetype', file], capture_output=True, text=True).stdout.strip() or mime_type
+        if key is not None:
+            with _MIME_CACHE_LOCK:
+                _MIME_CACHE.pop(file, None)  # Keep the most recently classified files at the end
+                _MIME_CACHE[file] = key + [mime_type]
 
-    output_file = start_print_process_visually(file, output, debug=debug)
+    program = _MIME_TABLES[1].get(mime_type, "")
+    logger.debug(f"File {file} has MIME type {mime_type} and default program {program}.")
+    return mime_type, program
 
-    return output_file, program_name
 
+def is_libreoffice_file(mime_type: str, program: str) -> bool:
+    return "libreoffice" in program or mime_type in LIBREOFFICE_MIME_TYPES
 
-def print_libreoffice_linux(file: str, output: Optional[str], debug: bool = False):
-    global FILE_PROGRAM_PROC
-    FILE_PROGRAM_PROC = subprocess.Popen(["libreoffice", "--norestore", "--nologo", file])
-    logger.info(f"Priting LibreOffice file {file}...")
-    program_name = "LibreOffice"
-    wait_for_program(program_name, pid=FILE_PROGRAM_PROC.pid)
 
-    output_file = start_print_process_visually(file, output, is_libreoffice=True, debug=debug)
+def _dir_state_file(kind: str, dir: str) -> str:
+    """Return the path of a per-directory state file in the cache directory."""
+    digest = hashlib.sha1(os.fsencode(dir)).hexdigest()
+    return os.path.join(CACHE_PATH, kind, f"{digest}.json")
 
-    return output_file, program_name
 
+def _read_json(path: str) -> Optional[dict]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
 
-def print_pdf_linux(file: str, output: Optional[str], debug: bool = False):
-    global FILE_PROGRAM_PROC
-    FILE_PROGRAM_PROC = subprocess.Popen(["firefox", "--new-window", file])
-    logger.info(f"Priting PDF {file}...")
+
+def _write_json(path: str, data: dict, mode: int = 0o644):
+    """
+    Write a JSON file atomically, so concurrent readers never see it half written.
+    The temporary file is created exclusively with an unpredictable name (a symlink planted in a shared
+    directory is never followed) and gets its final mode before it is renamed over `path`.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+            os.fchmod(f.fileno(), mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+
+def _iter_dir_files(dir: str):
+    """Yield the names of the regular files of a directory without building the whole listing."""
+    with os.scandir(dir) as entries:
+        for entry in entries:
+            if entry.is_file():
+                yield entry.name
+
+
+def _get_dir_index(dir: str) -> List[str]:
+    """Return the file names of a directory from the persisted index, rescanning it only if its mtime changed."""
+    index_file = _dir_state_file("dir-index", dir)
+    mtime_ns = os.stat(dir).st_mtime_ns
+    index = _read_json(index_file)
+    if index is not None and index.get("mtime_ns") == mtime_ns:
+        return index["files"]
+
+    logger.debug(f"Refreshing the file index of {dir}.")
+    files = list(_iter_dir_files(dir))
+    try:
+        _write_json(index_file, {"dir": dir, "mtime_ns": mtime_ns, "files": files})
+    except OSError as e:
+        logger.debug(f"Could not save the file index of {dir}: {e}")
+    return files
+
+
+def _reservoir_sample(names, exclude: set) -> Tuple[Optional[str], int]:
+    """Pick one name uniformly at random from an iterable in a single pass. Returns (name, number of candidates)."""
+    chosen = None
+    seen = 0
+    for name in names:
+        if name in exclude:
+            continue
+        seen += 1
+        if random.randrange(seen) == 0:
+            chosen = name
+    return chosen, seen
+
+
+def get_random_file_from_dir(dir: str, use_index: Optional[bool] = None, no_repeat: Optional[bool] = None) -> Optional[str]:
+    """
+    Return the absolute path of a random file of `dir`, or None if it has no files.
+    With `use_index` the listing is read from a persisted index instead of the directory,
+    and with `no_repeat` files already picked in previous runs are skipped until all of them have been printed.
+    """
+    use_index = DIR_INDEX if use_index is None else use_index
+    no_repeat = NO_REPEAT if no_repeat is None else no_repeat
+    dir = os.path.abspath(dir)
+    logger.info(f"Getting a random file from directory {dir}.")
+
+    printed_file = _dir_state_file("printed", dir)
+    printed = set((_read_json(printed_file) or {}).get("files", [])) if no_repeat else set()
+
+    def candidates():
+        return _get_dir_index(dir) if use_index else _iter_dir_files(dir)
+
+    chosen, count = _reservoir_sample(candidates(), printed)
+    if chosen is None and printed:
+        logger.info(f"All files in {dir} have already been printed, starting over.")
+        printed = set()
+        chosen, count = _reservoir_sample(candidates(), printed)
+    if chosen is None:
+        logger.info(f"No files found in {dir}.")
+        return None
+
+    if no_repeat:
+        printed.add(chosen)
+        try:
+            _write_json(printed_file, {"dir": dir, "files": sorted(printed)})
+        except OSError as e:
+            logger.debug(f"Could not save the printed files of {dir}: {e}")
+
+    random_file = os.path.join(dir, chosen)
+    logger.info(f"Random file chosen: {random_file} (out of {count} candidates).")
+    
+    return random_file
+
+
+# Windows printing functions (not implemented yet)
+
+def print_in_windows(
+        visible: bool, 
+        files: List[str],
+        min_delay: float,
+        max_delay: float,
+        delay: float,
+        output: Optional[str]
+    ):
+    pass
+
+
+# Linux printing functions
+
+
+# Compiled print dialog flows
+
+_CONDITION_HISTORY = None  # Recent condition wait times per application, loaded on first use
+
+
+def _condition_history() -> Dict[str, List[float]]:
+    global _CONDITION_HISTORY
+    if _CONDITION_HISTORY is None:
+        _CONDITION_HISTORY = _read_json(os.path.join(CACHE_PATH, "condition-waits.json")) or {}
+    return _CONDITION_HISTORY
+
+
+def save_condition_history():
+    if _CONDITION_HISTORY:
+        try:
+            _write_json(os.path.join(CACHE_PATH, "condition-waits.json"), _CONDITION_HISTORY)
+        except OSError as e:
+            logger.debug(f"Could not save the condition wait times: {e}")
+
+
+def condition_timeout(app: str, condition: str) -> float:
+    """
+    Timeout for `condition` in the print flow of `app`, learned from the recent runs:
+    CONDITION_TIMEOUT_FACTOR times the slowest recent wait, within [CONDITION_TIMEOUT_MIN, CONDITION_TIMEOUT_MAX].
+    """
+    recent = _condition_history().get(f"{app}:{condition}")
+    if not recent:
+        return CONDITION_TIMEOUT_DEFAULT
+    return min(CONDITION_TIMEOUT_MAX, max(CONDITION_TIMEOUT_MIN, CONDITION_TIMEOUT_FACTOR * max(recent)))
+
+
+def _output_state(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns
+    except OSError:
+        return None
+
+
+def window_pids() -> Dict[int, int]:
+    """Return the PID of the client of every window (0 if it does not set _NET_WM_PID) using wmctrl."""
+    result = subprocess.run(['wmctrl', '-lp'], capture_output=True, text=True)
+    pids = {}
+    for line in result.stdout.splitlines():
+        parts = line.split(None, 3)
+        try:
+            pids[int(parts[0], 16)] = int(parts[2])
+        except (IndexError, ValueError):
+            continue
+    return pids
+
+
+def active_window() -> Optional[int]:
+    """Return the ID of the window that has the focus, or None if xprop is not available or there is none."""
+    if not shutil.which('xprop'):
+        return None
+    result = subprocess.run(['xprop', '-root', '_NET_ACTIVE_WINDOW'], capture_output=True, text=True)
+    match = re.search(r'window id # (0x[0-9a-fA-F]+)', result.stdout)
+    return int(match.group(1), 16) if match else None
+
+
+def focus_window(wid: int, timeout: Optional[float] = None) -> bool:
+    """
+    Bring a window to the front and wait until it has the focus (CONDITION_TIMEOUT_DEFAULT seconds at most).
+    Returns False if it did not get it. Without xprop the focus cannot be checked, so the window manager
+    is given a second instead.
+    """
+    subprocess.run(["wmctrl", "-ia", hex(wid)])
+    if not shutil.which('xprop'):
+        sleep(1)
+        return True
+    deadline = time.monotonic() + (CONDITION_TIMEOUT_DEFAULT if timeout is None else timeout)
+    while active_window() != wid:
+        if time.monotonic() >= deadline:
+            return False
+        sleep(CONDITION_POLL_INTERVAL)
+    return True
+
+
+def wait_for_window_closed(wid: int, timeout: float = 2.0) -> bool:
+    """Wait until a window is gone. Returns False on timeout (REAPER is left to close it)."""
+    deadline = time.monotonic() + timeout
+    while any(window == wid for window, _ in list_windows()):
+        if time.monotonic() >= deadline:
+            return False
+        sleep(CONDITION_POLL_INTERVAL)
+    return True
+
+
+def wait_for_condition(app: str, condition: str, flow: dict) -> float:
+    """
+    Wait until `condition` holds for the print flow described by `flow` (see _run_print_flow):
+    'ready' (the window of the document has the focus, so it takes the keys sent to it),
+    'dialog' (a window of the program of the document that was not in flow["windows_before"] is mapped),
+    'closed' (the last dialog found by a 'dialog' condition is gone) or 'output' (the output file was
+    written since the flow started). Returns the time waited.
+    Raises TimeoutError if the condition is not met within the learned timeout: the keys that follow
+    would be typed into the wrong window.
+    """
+    timeout = condition_timeout(app, condition)
+    recent = _condition_history().setdefault(f"{app}:{condition}", [])
+    dialogs = flow["dialogs"]
+    start = time.monotonic()
+    activated = False
+    while True:
+        if condition == 'ready':
+            met = active_window() == flow["wid"]
+            if not met and not activated:
+                if not shutil.which('xprop'):  # The focus cannot be checked, settle for asking for it
+                    met = True
+                subprocess.run(["wmctrl", "-ia", hex(flow["wid"])])
+                activated = True
+        elif condition == 'dialog':
+            pids = window_pids()
+            new = [wid for wid in pids if wid not in flow["windows_before"]]
+            if flow["owner"]:  # Notifications or the window of a program launched meanwhile are not the dialog
+                new = [wid for wid in new if pids[wid] == flow["owner"]]
+            met = bool(new)
+            if met:
+                dialogs.append(new[-1])
+        elif condition == 'closed':
+            current = {wid for wid, _ in list_windows()}
+            if dialogs:
+                met = dialogs[-1] not in current
+            else:  # The dialog was never seen, settle for any window of the flow closing
+                met = bool(flow["windows_before"] - current)
+            if met and dialogs:
+                dialogs.pop()
+        else:
+            state = _output_state(flow["output_file"])
+            met = state is not None and state[0] > 0 and state != flow["output_before"]
+        elapsed = time.monotonic() - start
+        if met:
+            recent.append(round(elapsed, 3))
+            del recent[:-20]  # Only the last runs count, so the timeout follows the machine
+            logger.debug(f"Condition '{condition}' of {app} met after {elapsed:.2f} seconds.")
+            return elapsed
+        if elapsed >= timeout:
+            # Remember the miss as a wait of the whole timeout, so the next timeout grows on a slower machine
+            recent.append(round(elapsed, 3))
+            del recent[:-20]
+            raise TimeoutError(f"Condition '{condition}' of {app} not met after {timeout:.2f} seconds.")
+        sleep(CONDITION_POLL_INTERVAL)
+
+
+@functools.lru_cache(maxsize=None)
+def compile_print_flow(app: str, overwrite: bool) -> Tuple[str, ...]:
+    """
+    Build the whole print dialog flow of `app` ('libreoffice', 'firefox' or 'default') as input-simulation
+    keyboard steps. 'W,<condition>' steps are not sent: the flow waits there for the condition (see
+    wait_for_condition). The output file is left as the '{output}' placeholder, so a plan only depends on
+    the application and on whether the output already exists (LibreOffice then asks for confirmation).
+    """
+    plan = [
+        'W,ready',  # The document window has the focus
+        'K,Ctrl+P',  # Start the print dialog
+    ]
+
+    # Go to the printers list
+    if app == 'libreoffice':
+        plan += [
+            'W,dialog',
+            'K,Shift+Tab,5',  # Go to the print option
+            'K,Space',  # Select the print option
+            'T,"imprimir"',  # Change the printer to print to a file
+            'S,0.0',
+            'K,Enter,2',  # Select the printer
+            'W,dialog',  # The file dialog
+        ]
+    elif app == 'firefox':
+        plan += [
+            'S,3.0',  # The print preview is part of the browser window, there is no window to wait for
+            'K,Tab,5',  # Go to the print option
+            'K,Enter',  # Select the print option
+            'W,dialog',  # The system print dialog
+            'K,Tab',  # Go to the list of printers
+            'T,"imprimir"',  # Change the printer to print to a file
+            'S,0.0',
+            'K,Tab,2',  # Select the filename field,
+            'S,0.0',
+            'K,Enter',  # Press Enter to write the filename
+            'W,dialog',  # The file chooser
+        ]
+    else:
+        plan += [
+            'W,dialog',
+            'K,Tab,1',  # Go to the printer text field
+            'T,"imprimir"',  # Write "imprimir" to ensure the right printer is selected
+            'S,0.0',
+            'K,Tab,2',  # Go to the filename field
+            'K,Enter',  # Press Enter to write the filename
+            'W,dialog',  # The file chooser
+        ]
+
+    # Write the filename
+    plan += [
+        'K,Ctrl+A',  # Select all text
+        'S,0.0',
+        'T,"{output}"',  # Type the filename
+        'K,Enter',  # Select the filename
+    ]
+
+    if app == 'libreoffice':
+        if overwrite:
+            plan += [
+                'W,dialog',  # Confirmation dialog of an existing file
+                'K,Tab',
+                'K,Enter',
+            ]
+        plan += [
+            'K,Tab',
+            'K,Enter',
+            # 'K,Ctrl+Z,2'  # Needed to undo in case of printing a text file
+        ]
+    else:
+        plan += [
+            'W,closed',  # Back to the print dialog once the file chooser is gone
+            'K,Shift+Tab,3',  # Go to the "Print" button
+            'K,Enter,2',  # Two presses in case of confirmation dialog of an existing file
+            'K,Ctrl+Z'  # Needed to undo in case of printing a text file
+        ]
+    plan.append('W,output')  # Let the program write the PDF
+    return tuple(plan)
+
+
+def _run_print_flow(app: str, plan: Tuple[str, ...], output_file: str, wid: int, debug: bool = False):
+    """
+    Send the steps of a compiled plan, one input-simulation call between two conditions.
+    `wid` is the window of the document: the dialogs of the flow are the new windows of its program.
+    """
+    args = {"--press-interval": INPUT_PRESS_INTERVAL, "--typing-interval": INPUT_TYPING_INTERVAL}
+    flow = {
+        "wid": wid,
+        "owner": window_pids().get(wid),
+        "windows_before": set(),
+        "dialogs": [],
+        "output_file": output_file,
+        "output_before": _output_state(output_file),
+    }
+    sequence = []
+    for step in plan:
+        if not step.startswith('W,'):
+            sequence.append(step.replace('{output}', output_file))
+            continue
+        if sequence:
+            flow["windows_before"] = {window for window, _ in list_windows()}
+            input_keyboard_sequence(sequence, args, debug)
+            sequence = []
+        wait_for_condition(app, step[2:], flow)
+    if sequence:
+        input_keyboard_sequence(sequence, args, debug)
+
+
+@traced("print_dialog")
+def start_print_process_visually(
+        file: str, 
+        output: Optional[str],
+        wid: int,
+        is_libreoffice: bool = False,
+        is_firefox: bool = False,
+        debug: bool = False
+    ) -> str:
+    # Check the output (is it a directory or a filename?)
+    output_file = process_output(file, output)
+
+    app = 'libreoffice' if is_libreoffice else 'firefox' if is_firefox else 'default'
+    overwrite = os.path.exists(output_file)
+    plan = compile_print_flow(app, overwrite)
+    logger.debug(f"Running the print dialog flow of {app} for {file} ({len(plan)} steps, overwrite: {overwrite}).")
+
+    try:
+        _run_print_flow(app, plan, output_file, wid, debug)
+    finally:
+        save_condition_history()  # Missed conditions too, they raise the next timeouts
+
+    return output_file
+
+
+# Reused application instances
+
+# Process kept open for each application with --reuse-apps. Documents opened later with the usual
+# command are handed to it by the application itself, so closing their window leaves it running.
+APP_INSTANCE_COMMANDS = {
+    'eog': ['eog'],
+    'gedit': ['gedit', '--new-window'],
+    'libreoffice': ['libreoffice', '--norestore', '--nologo', '--invisible'],  # No window at all
+    'firefox': ['firefox', '--new-window', 'about:blank'],
+}
+
+
+class AppInstance:
+    def __init__(self, app: str):
+        self.app = app
+        self.proc: Optional[subprocess.Popen] = None
+        self.wid: Optional[int] = None  # Window kept open so the application does not exit
+        self.documents = 0
+
+    def start(self):
+        command = APP_INSTANCE_COMMANDS[self.app]
+        windows_before = {wid for wid, _ in list_windows()}
+        REAPER.finish(command[0])
+        self.proc = subprocess.Popen(command)
+        logger.debug(f"Started a reusable {self.app} instance (PID: {self.proc.pid}).")
+        if '--invisible' not in command:
+            self.wid = wait_for_program("", pid=self.proc.pid, exclude=windows_before)
+
+    def is_alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def close(self):
+        logger.debug(f"Closing the reusable {self.app} instance (PID: {self.proc.pid}, {self.documents} document(s)).")
+        if self.wid is not None and self.is_alive():
+            subprocess.run(["wmctrl", "-ic", hex(self.wid)])  # Close it gracefully first
+        close_failsafe(self.proc, self.wid)
+
+
+APP_INSTANCES: Dict[str, AppInstance] = {}
+
+
+def _app_instance_windows() -> frozenset:
+    return frozenset(instance.wid for instance in APP_INSTANCES.values() if instance.wid is not None)
+
+
+def _app_restart_due(app: str) -> bool:
+    """Whether the next document opened in `app` restarts its reused instance (closing every window in it)."""
+    instance = APP_INSTANCES.get(app)
+    return instance is not None and (not instance.is_alive() or instance.documents >= MAX_DOCS_PER_APP)
+
+
+def launch_app(app: str, command: List[str], cwd: Optional[str] = None) -> subprocess.Popen:
+    """
+    Run `command` to open a document in `app`. With --reuse-apps, the document is opened in the
+    instance of the application kept for the whole run, which is restarted every MAX_DOCS_PER_APP documents.
+    """
+    if REUSE_APPS and app in APP_INSTANCE_COMMANDS:
+        instance = APP_INSTANCES.get(app)
+        if _app_restart_due(app):
+            close_app_instance(app)
+            instance = None
+        if instance is None:
+            instance = APP_INSTANCES[app] = AppInstance(app)
+            instance.start()
+        instance.documents += 1
+    REAPER.finish(command[0])
+    return subprocess.Popen(command, cwd=cwd)
+
+
+def close_app_instance(app: str):
+    instance = APP_INSTANCES.pop(app, None)
+    if instance is not None:
+        instance.close()
+
+
+def close_app_instances():
+    """Shut down every application instance kept by --reuse-apps."""
+    for app in list(APP_INSTANCES):
+        close_app_instance(app)
+
+
+def _wait_for_launched(proc: subprocess.Popen, program_name: str, windows_before: set) -> int:
+    """
+    Wait for the window of a program just launched, closing it if it never shows up.
+    Windows that existed before the launch (`windows_before`) are never taken for it, like the
+    window of the file being printed while the next one is launched with --pipeline.
+    """
+    try:
+        return wait_for_program(program_name, pid=proc.pid, exclude=windows_before)
+    except TimeoutError:
+        close_failsafe(proc)
+        raise
+
+
+def launch_image_linux(file: str) -> Tuple[subprocess.Popen, str, int]:
+    dir_path = os.path.dirname(os.path.abspath(os.path.expanduser(file)))
+    windows_before = {wid for wid, _ in list_windows()}
+    with span("launch", program="eog"):
+        proc = launch_app('eog', ["eog", file], cwd=dir_path)
+    # In case of eog, the program name is the name of the file (just the last part)
+    program_name = os.path.basename(file)
+    return proc, program_name, _wait_for_launched(proc, program_name, windows_before)
+
+
+def launch_text_linux(file: str) -> Tuple[subprocess.Popen, str, int]:
+    windows_before = {wid for wid, _ in list_windows()}
+    with span("launch", program="gedit"):
+        proc = launch_app('gedit', ["gedit", "--new-window", file] if REUSE_APPS else ["gedit", file])
+    program_name = "gedit"
+    return proc, program_name, _wait_for_launched(proc, program_name, windows_before)
+
+
+def launch_libreoffice_linux(file: str) -> Tuple[subprocess.Popen, str, int]:
+    windows_before = {wid for wid, _ in list_windows()}
+    with span("launch", program="libreoffice"):
+        proc = launch_app('libreoffice', ["libreoffice", "--norestore", "--nologo", file])
+    program_name = "LibreOffice"
+    return proc, program_name, _wait_for_launched(proc, program_name, windows_before)
+
+
+def launch_pdf_linux(file: str) -> Tuple[subprocess.Popen, str, int]:
+    windows_before = {wid for wid, _ in list_windows()}
+    with span("launch", program="firefox"):
+        proc = launch_app('firefox', ["firefox", "--new-window", file])
     basename = os.path.basename(file)
     program_name = f"{basename} — Mozilla Firefox"
-    wait_for_program(program_name, pid=FILE_PROGRAM_PROC.pid)
+    return proc, program_name, _wait_for_launched(proc, program_name, windows_before)
+
+
+def print_image_linux(file: str, output: Optional[str], debug: bool = False):
+    global FILE_PROGRAM_PROC
+    logger.info(f"Priting image {file}...")
+    FILE_PROGRAM_PROC, program_name, wid = launch_image_linux(file)
+
+    output_file = start_print_process_visually(file, output, wid, debug=debug)
+
+    return output_file, program_name, wid
+
+
+def print_text_linux(file: str, output: Optional[str], debug: bool = False):
+    global FILE_PROGRAM_PROC
+    logger.info(f"Priting text file {file}...")
+    FILE_PROGRAM_PROC, program_name, wid = launch_text_linux(file)
+
+    output_file = start_print_process_visually(file, output, wid, debug=debug)
+
+    return output_file, program_name, wid
+
+
+def print_libreoffice_linux(file: str, output: Optional[str], debug: bool = False):
+    global FILE_PROGRAM_PROC
+    logger.info(f"Priting LibreOffice file {file}...")
+    FILE_PROGRAM_PROC, program_name, wid = launch_libreoffice_linux(file)
+
+    output_file = start_print_process_visually(file, output, wid, is_libreoffice=True, debug=debug)
+
+    return output_file, program_name, wid
+
+
+def print_pdf_linux(file: str, output: Optional[str], debug: bool = False):
+    global FILE_PROGRAM_PROC
+    logger.info(f"Priting PDF {file}...")
+    FILE_PROGRAM_PROC, program_name, wid = launch_pdf_linux(file)
+
+    output_file = start_print_process_visually(file, output, wid, is_firefox=True, debug=debug)
+
+    return output_file, program_name, wid
+
+
+def _firefox_running() -> bool:
+    """Whether a Firefox started by printer-simulation (the source of a PDF job or a reused instance) is running."""
+    instance = APP_INSTANCES.get('firefox')
+    if instance is not None and instance.is_alive():
+        return True
+    return (
+        FILE_PROGRAM_PROC is not None and FILE_PROGRAM_PROC.poll() is None
+        and isinstance(FILE_PROGRAM_PROC.args, list) and FILE_PROGRAM_PROC.args[0] == "firefox"
+    )
+
+
+@traced("open_pdf")
+def open_pdf_linux(
+        file: str,
+        delay: Union[float, Tuple[float, float]],
+        debug: bool = False,
+        before_close: Optional[Callable[[], None]] = None
+    ):
+    """
+    Open the generated PDF, read it for `delay` seconds and close it with the keyboard.
+    `before_close` is called once the reading is over, to wait for anything that could map a window and
+    take the focus while the window is being closed.
+    """
+    logger.info(f"Opening generated PDF {file}.")
+    
+    global PRINT_PROGRAM_PROC
+    
+    # A running Firefox gets the new window itself (the command only hands it the file and exits),
+    # so there is no second browser to start and to tear down
+    REAPER.finish("firefox")  # A browser being closed would take the PDF with it
+    shared = _firefox_running()
+    windows_before = {wid for wid, _ in list_windows()}
+    # PRINT_PROGRAM_PROC = subprocess.Popen(["evince", file])  # FIXME: This is not working
+    proc = subprocess.Popen(["firefox", "--new-window", file])
+    if not shared:
+        PRINT_PROGRAM_PROC = proc
+    window_name = f"{file} — Mozilla Firefox".split("/")[-1]  # Get the last part of the path
+    wid = wait_for_program(window_name, pid=proc.pid, exclude=windows_before)
+    logger.info(f"Simulating reading the PDF...")
+    with span("read"):
+        sleep_action(delay)  # TODO: add actions such as zooming, scrolling, etc.
+    if before_close is not None:
+        before_close()
+
+    # Ensure the focus is on the window of the PDF
+    logger.debug(f"Changing focus to {window_name} (window: {hex(wid)}).")
+    if focus_window(wid):
+        input_key('Alt+F4', debug=debug)  # Close the evince/firefox window
+    else:
+        logger.warning(f"{window_name} did not get the focus, closing it by its window ID instead.")
+    if shared:
+        try:
+            proc.wait(timeout=1)
+        except subprocess.TimeoutExpired:  # The running Firefox did not take the file, it is a browser of its own
+            pass
+        close_failsafe(proc, wid)  # Either the browser or, if the command exited, only its window
+    else:
+        close_failsafe(PRINT_PROGRAM_PROC, wid)
+    wait_for_window_closed(wid)
+
+
+def print_visually_linux(
+        files: List[str],
+        delay: Union[float, Tuple[float, float]],
+        output: Optional[str],
+        debug: bool = False
+    ):
+    global FILE_PROGRAM_PROC
+
+    if VISUAL_PIPELINE:
+        import asyncio  # Only the pipelined mode needs it, and it is slow to import
+        asyncio.run(_print_visually_pipelined(files, delay, output, debug))
+        return
+    
+    for file in files:
+        file = os.path.abspath(os.path.expanduser(file))
+        if os.path.isdir(file):  # Get random file if a dir is provided
+            file = get_random_file_from_dir(file)
+            if file is None:
+                return
+
+        with span("job", job=file, mode="visible") as job:
+            # Get the program based on the MIME type of the file
+            mime_type, program = get_mime_info(file)
+            job["file_type"] = mime_type
+    
+            # Check if the file is an image
+            if "eog" in program or mime_type.startswith('image/'):
+                output_file, program, wid = print_image_linux(file, output, debug)
+            # Check if the file is a LibreOffice file
+            elif is_libreoffice_file(mime_type, program):
+                logger.info(f"Printing LibreOffice file {file}.")
+                output_file, program, wid = print_libreoffice_linux(file, output, debug)
+            # Check if the file is a PDF
+            elif "evince" in program or mime_type == 'application/pdf':
+                logger.info(f"Printing PDF file {file}.")
+                output_file, program, wid = print_pdf_linux(file, output, debug)
+            # Check if the file a text file
+            else:
+                logger.info(f"Printing text file {file}.")
+                output_file, program, wid = print_text_linux(file, output, debug)
+            # else:
+            #     output_file = ""
+
+            open_pdf_linux(output_file, delay, debug)
+
+            close_source_program(FILE_PROGRAM_PROC, program, wid, debug)
+
+
+def close_source_program(proc: subprocess.Popen, program: str, wid: int, debug: bool = False):
+    with span("close_app", program=program):
+        # Focus again on the original program (its own window, a reused instance may have more)
+        logger.debug(f"Changing focus back to {program}.")
+        if focus_window(wid):
+            input_key('Alt+F4', debug=debug)  # Close the file viewer
+        else:
+            logger.warning(f"{program} did not get the focus, closing it by its window ID instead.")
+        close_failsafe(proc, wid)
+        wait_for_window_closed(wid)
+
+
+# Pipelined visible mode
+
+def _visual_job_kind(mime_type: str, program: str) -> str:
+    """Same choice of program as print_visually_linux: 'image', 'libreoffice', 'pdf' or 'text'."""
+    if "eog" in program or mime_type.startswith('image/'):
+        return 'image'
+    elif is_libreoffice_file(mime_type, program):
+        return 'libreoffice'
+    elif "evince" in program or mime_type == 'application/pdf':
+        return 'pdf'
+    return 'text'
+
+
+VISUAL_JOB_LAUNCHERS = {
+    'image': launch_image_linux,
+    'libreoffice': launch_libreoffice_linux,
+    'pdf': launch_pdf_linux,
+    'text': launch_text_linux,
+}
+
+
+VISUAL_JOB_PROGRAMS = {
+    'image': 'eog',
+    'libreoffice': 'libreoffice',
+    'pdf': 'firefox',
+    'text': 'gedit',
+}
+
+
+def _classify_visual_job(file: str) -> Optional[dict]:
+    """Pick the file to print (a random one for directories) and the kind of program that opens it."""
+    started = time.monotonic_ns()
+    file = os.path.abspath(os.path.expanduser(file))
+    if os.path.isdir(file):  # Get random file if a dir is provided
+        file = get_random_file_from_dir(file)
+        if file is None:
+            return None
+    mime_type, program = get_mime_info(file)
+    return {"file": file, "mime_type": mime_type, "kind": _visual_job_kind(mime_type, program), "started": started}
+
+
+def _prepare_visual_job(job: dict) -> dict:
+    """Background step: launch the program of a classified job and wait for its window. No input is sent."""
+    with span("prepare", job=job["file"], file_type=job["mime_type"], mode="visible"):
+        logger.info(f"Opening {job['kind']} file {job['file']}.")
+        proc, program_name, wid = VISUAL_JOB_LAUNCHERS[job["kind"]](job["file"])
+    return dict(job, proc=proc, program=program_name, wid=wid)
+
+
+def _can_prepare_during(job: dict, upcoming: dict) -> bool:
+    """
+    Whether the program of `upcoming` can be launched while `job` is still open. Without --reuse-apps,
+    a running firefox, eog, gedit or LibreOffice would take the document of the new command, and the
+    document would be closed with the process of `job` (or with the Firefox showing its output).
+    With --reuse-apps, the same goes for a launch that restarts the instance holding the windows of `job`,
+    or that starts the instance while `job` opens its output in a Firefox of its own.
+    """
+    program = VISUAL_JOB_PROGRAMS[upcoming["kind"]]
+    if program not in (VISUAL_JOB_PROGRAMS[job["kind"]], "firefox"):
+        return True
+    return REUSE_APPS and program in APP_INSTANCES and not _app_restart_due(program)
+
+
+def _print_prepared_job(job: dict, output: Optional[str], debug: bool = False) -> str:
+    """Input step: bring the window of a prepared job to the front and go through its print dialog."""
+    global FILE_PROGRAM_PROC
+    FILE_PROGRAM_PROC = job["proc"]
+    logger.info(f"Printing {job['kind']} file {job['file']}.")
+    # The program of the next file may have been launched over it
+    subprocess.run(["wmctrl", "-ia", hex(job["wid"])])
+    return start_print_process_visually(
+        job["file"], output, job["wid"], is_libreoffice=job["kind"] == 'libreoffice', is_firefox=job["kind"] == 'pdf', debug=debug
+    )
+
+
+async def _print_visually_pipelined(
+        files: List[str],
+        delay: Union[float, Tuple[float, float]],
+        output: Optional[str],
+        debug: bool = False
+    ):
+    """
+    Print the files with the steps that need the keyboard (print dialog, closing windows) strictly in order,
+    while the next file's program is launched and waited for in the background during the reading of the
+    current output. The steps run in worker threads, the event loop only sequences them.
+    A program that the current job still has open is only launched once the job is over.
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+
+    def in_thread(name: str, job: dict, function, *args) -> asyncio.Future:
+        def call():
+            with span(name, job=job["file"], file_type=job["mime_type"], mode="visible"):
+                return function(*args)
+        return loop.run_in_executor(None, call)
+
+    # Launches run in their own thread, so the keyboard steps can wait for them to map their window
+    launcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prepare")
+    upcoming = await loop.run_in_executor(None, _classify_visual_job, files[0]) if files else None
+    prepared = asyncio.wrap_future(launcher.submit(_prepare_visual_job, upcoming)) if upcoming else None
+    try:
+        for index in range(len(files)):
+            if prepared is None:
+                return
+            job, prepared = await prepared, None
+            output_file = await in_thread("print", job, _print_prepared_job, job, output, debug)
+
+            launch = None
+            upcoming = await loop.run_in_executor(None, _classify_visual_job, files[index + 1]) if index + 1 < len(files) else None
+            if upcoming is not None and _can_prepare_during(job, upcoming):
+                launch = launcher.submit(_prepare_visual_job, upcoming)
+                prepared = asyncio.wrap_future(launch)
+            # A window mapped while the output is being closed would take the focus and get the Alt+F4
+            await in_thread("read_output", job, open_pdf_linux, output_file, delay, debug, launch.exception if launch else None)
+            await in_thread("close_source", job, close_source_program, job["proc"], job["program"], job["wid"], debug)
+            if upcoming is not None and launch is None:
+                prepared = asyncio.wrap_future(launcher.submit(_prepare_visual_job, upcoming))
+            if TRACER is not None:  # The steps of a job ran in several threads, record the job as a whole
+                TRACER.add("job", job["started"], job=job["file"], file_type=job["mime_type"], mode="visible")
+    finally:
+        if prepared is not None:  # Do not leave behind a program launched for a file that will not be printed
+            try:
+                job = await prepared
+                close_failsafe(job["proc"], job["wid"])
+            except Exception:
+                pass
+        launcher.shutdown()
+
+
+# Render cache
+
+FICLONE = 0x40049409  # ioctl that makes a copy-on-write clone of a file (btrfs, XFS...)
+
+
+def _clone_file(src: Path, dst: str):
+    """Make `dst` a copy of `src` with the cheapest method available: reflink, then hard link, then a plain copy."""
+    try:
+        with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        return
+    except OSError:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+        shutil.copyfile(src, dst)
+
+
+class RenderCache:
+    """
+    PDFs rendered in invisible mode, stored by the SHA-256 of the content of their input.
+    A render being stored is guarded by a FileLock per content, so processes rendering the same
+    content at the same time wait for the first one instead of rendering it again. Entries are evicted
+    under the same lock.
+    """
+    def __init__(self, directory: str, max_size: int):
+        self.directory = Path(directory)
+        self.max_size = max_size
+
+    def key(self, file: str, kind: str) -> Optional[str]:
+        """Hash the content of `file` in chunks, along with the backend (`kind`) that renders it."""
+        digest = hashlib.sha256(kind.encode() + b"\0")
+        buffer = bytearray(1024 * 1024)
+        view = memoryview(buffer)
+        try:
+            with open(file, "rb", buffering=0) as f:
+                while True:
+                    size = f.readinto(buffer)
+                    if not size:
+                        break
+                    digest.update(view[:size])
+        except OSError as e:
+            logger.debug(f"Could not hash {file} for the render cache: {e}")
+            return None
+        return digest.hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.pdf"
+
+    def lock(self, key: str) -> "FileLock":
+        self.path(key).parent.mkdir(parents=True, exist_ok=True)
+        return FileLock(str(self.path(key)) + ".lock")
+
+    def fetch(self, key: str, output_file: str) -> bool:
+        """Write the cached PDF of `key` to `output_file`. False if it is not cached."""
+        entry = self.path(key)
+        tmp_path = os.path.join(os.path.dirname(output_file) or ".", f".{os.path.basename(output_file)}.{os.getpid()}.{threading.get_ident()}")
+        try:
+            _clone_file(entry, tmp_path)
+            os.replace(tmp_path, output_file)
+            os.utime(entry)  # The mtime of the entries is their last use
+            found = True
+        except FileNotFoundError:
+            found = False
+        # rename() does nothing when both names are links to the same file, so the temporary name can be left
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        return found
+
+    def store(self, key: str, pdf: str):
+        entry = self.path(key)
+        tmp_path = f"{entry}.{os.getpid()}.{threading.get_ident()}"
+        try:
+            entry.parent.mkdir(parents=True, exist_ok=True)
+            _clone_file(Path(pdf), tmp_path)
+            os.replace(tmp_path, entry)
+        except OSError as e:
+            logger.debug(f"Could not store {pdf} in the render cache: {e}")
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+
+    def trim(self):
+        """Evict the least recently used PDFs until the cache fits in its maximum size."""
+        try:
+            with FileLock(str(self.directory / ".trim.lock"), timeout=0):
+                entries = []
+                for entry in self.directory.glob("*/*.pdf"):
+                    with contextlib.suppress(FileNotFoundError):
+                        st = entry.stat()
+                        entries.append((st.st_mtime_ns, st.st_size, entry))
+                total = sum(size for _, size, _ in entries)
+                evicted = 0
+                for _, size, entry in sorted(entries):
+                    if total <= self.max_size:
+                        break
+                    # Under the lock of its content, so it is never evicted while it is being rendered or stored.
+                    # The lock files stay: removing one that another process holds would let a second holder in.
+                    try:
+                        with self.lock(entry.stem).acquire(timeout=0):
+                            entry.unlink()
+                            evicted += 1
+                    except Timeout:
+                        continue
+                    except FileNotFoundError:
+                        pass  # Already evicted by another process
+                    total -= size
+                if evicted:
+                    logger.debug(f"Evicted {evicted} PDF(s) from the render cache ({total / 1024 ** 2:.1f} MiB left).")
+        except Timeout:
+            pass  # Another process is already trimming it
+        except OSError as e:
+            logger.debug(f"Could not trim the render cache: {e}")
+
+
+def get_render_cache() -> Optional[RenderCache]:
+    """Return the render cache, or None if it is disabled."""
+    if not RENDER_CACHE:
+        return None
+    return RenderCache(os.path.join(CACHE_PATH, "renders"), RENDER_CACHE_MAX_SIZE * 1024 ** 2)
+
+
+def _render_with_cache(
+    cache: RenderCache,
+    keys: Dict[str, Optional[str]],
+    output: Optional[str],
+    render: Callable[[List[str]], Dict[str, Union[str, Exception]]]
+) -> Dict[str, Union[str, Exception]]:
+    """
+    Return the output (or the error) of every file of `keys`, calling `render` only for the contents not cached yet.
+    Files with the same content are rendered once, and contents that another process is rendering are waited for.
+    """
+    results: Dict[str, Union[str, Exception]] = {}
+    groups: Dict[str, List[str]] = {}
+    uncached: List[str] = []
+    for file, key in keys.items():
+        if key is None:
+            uncached.append(file)
+        else:
+            groups.setdefault(key, []).append(file)
+
+    def serve(key: str, files: List[str]) -> bool:
+        for file in files:
+            try:
+                output_file = process_output(file, output)
+            except ValueError as e:
+                results[file] = e
+                continue
+            started = time.monotonic_ns()
+            with span("cache_fetch", job=file, mode="invisible"):
+                if not cache.fetch(key, output_file):
+                    return False
+            if TRACER is not None:  # A miss is recorded as a job by the render that follows it
+                TRACER.add("job", started, job=file, file_type=get_mime_info(file)[0], mode="invisible", cached=True)
+            logger.info(f"File {file} was already rendered, reused the cached PDF for {output_file}.")
+            results[file] = output_file
+        return True
+
+    def render_and_store(locked: Dict[str, List[str]]):
+        results.update(render([files[0] for files in locked.values()] + uncached) if locked or uncached else {})
+        uncached.clear()
+        for key, files in locked.items():
+            first = results.get(files[0])
+            if isinstance(first, str):
+                cache.store(key, first)
+                if serve(key, files[1:]):
+                    continue
+            for file in files[1:]:
+                results[file] = first if isinstance(first, Exception) else FileNotFoundError(f"The render of {files[0]} is not in the cache.")
+
+    locks, locked, busy = [], {}, {}
+    try:
+        for key, files in groups.items():
+            if serve(key, files):
+                continue
+            lock = cache.lock(key)
+            try:
+                lock.acquire(timeout=0)
+            except Timeout:
+                busy[key] = files
+                continue
+            locks.append(lock)
+            # Rendered by another process between the check and the lock
+            if not serve(key, files):
+                locked[key] = files
+        render_and_store(locked)
+    finally:
+        for lock in locks:
+            lock.release()
+
+    for key, files in busy.items():
+        logger.debug(f"Waiting for another process to render the content of {files[0]}.")
+        with cache.lock(key):
+            if not serve(key, files):
+                render_and_store({key: files})
+    return results
+
+
+# LibreOffice conversion pool
+
+def _uno_props(**kwargs) -> tuple:
+    """Build a tuple of UNO PropertyValue structs from keyword arguments."""
+    import uno
+    props = []
+    for name, value in kwargs.items():
+        prop = uno.createUnoStruct("com.sun.star.beans.PropertyValue")
+        prop.Name = name
+        prop.Value = value
+        props.append(prop)
+    return tuple(props)
+
+
+def _pdf_filter_for(document) -> str:
+    """Return the PDF export filter matching the type of a loaded document."""
+    if document.supportsService("com.sun.star.sheet.SpreadsheetDocument"):
+        return "calc_pdf_Export"
+    if document.supportsService("com.sun.star.presentation.PresentationDocument"):
+        return "impress_pdf_Export"
+    if document.supportsService("com.sun.star.drawing.DrawingDocument"):
+        return "draw_pdf_Export"
+    return "writer_pdf_Export"
+
+
+class LibreOfficeInstance:
+    """
+    Headless LibreOffice process listening on a local UNO pipe.
+    Every instance has its own user profile, so several of them can run in parallel.
+    """
+    def __init__(self, index: int, connect_timeout: float = LIBREOFFICE_POOL_CONNECT_TIMEOUT):
+        self.index = index
+        self.connect_timeout = connect_timeout
+        self.pipe_name = f"printer-simulation-{os.getpid()}-{index}"
+        self.profile_dir: Optional[str] = None
+        self.proc: Optional[subprocess.Popen] = None
+        self.desktop = None
+        self.converted = 0
+
+    def start(self):
+        import uno
+        self.profile_dir = tempfile.mkdtemp(prefix="printer-simulation-lo-")
+        self.proc = subprocess.Popen([
+            "libreoffice",
+            "--headless",
+            "--invisible",
+            "--nologo",
+            "--norestore",
+            "--nodefault",
+            "--nolockcheck",
+            f"-env:UserInstallation={Path(self.profile_dir).as_uri()}",
+            f"--accept=pipe,name={self.pipe_name};urp;StarOffice.ComponentContext"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext("com.sun.star.bridge.UnoUrlResolver", local_context)
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                context = resolver.resolve(f"uno:pipe,name={self.pipe_name};urp;StarOffice.ComponentContext")
+                break
+            except Exception as e:
+                if self.proc.poll() is not None or time.monotonic() > deadline:
+                    self.stop()
+                    raise RuntimeError(f"Could not connect to pooled LibreOffice instance {self.index}.") from e
+                sleep(0.2)
+        self.desktop = context.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", context)
+        self.converted = 0
+        logger.debug(f"Pooled LibreOffice instance {self.index} ready (PID: {self.proc.pid}).")
+
+    def is_healthy(self) -> bool:
+        if self.proc is None or self.proc.poll() is not None or self.desktop is None:
+            return False
+        try:
+            self.desktop.getFrames()  # Cheap round trip to check that the UNO bridge still answers
+            return True
+        except Exception:
+            return False
+
+    def convert(self, input_file: Path, output_pdf: Path):
+        import uno
+        document = self.desktop.loadComponentFromURL(
+            uno.systemPathToFileUrl(str(input_file)), "_blank", 0, _uno_props(Hidden=True, ReadOnly=True)
+        )
+        if document is None:
+            raise RuntimeError(f"LibreOffice could not load {input_file}.")
+        try:
+            document.storeToURL(
+                uno.systemPathToFileUrl(str(output_pdf)), _uno_props(FilterName=_pdf_filter_for(document))
+            )
+        finally:
+            document.close(True)
+        self.converted += 1
+
+    def stop(self):
+        if self.desktop is not None:
+            try:
+                self.desktop.terminate()
+            except Exception:
+                pass  # The bridge is gone when terminate() succeeds, ignore the disposed exception
+            self.desktop = None
+        if self.proc is not None:
+            try:
+                self.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+            self.proc = None
+        if self.profile_dir is not None:
+            shutil.rmtree(self.profile_dir, ignore_errors=True)
+            self.profile_dir = None
+
+
+class LibreOfficePool:
+    """
+    Pool of warm headless LibreOffice instances that convert documents to PDF over UNO.
+    Unhealthy instances are restarted before use and every instance is recycled after `recycle_after` documents.
+    """
+    def __init__(self, size: int, recycle_after: int = LIBREOFFICE_POOL_RECYCLE, connect_timeout: float = LIBREOFFICE_POOL_CONNECT_TIMEOUT):
+        self.size = size
+        self.recycle_after = recycle_after
+        self.instances = [LibreOfficeInstance(i, connect_timeout) for i in range(size)]
+        self.available = queue.Queue()
+        for instance in self.instances:
+            self.available.put(instance)
+
+    def _restart(self, instance: LibreOfficeInstance, reason: str):
+        logger.debug(f"Restarting pooled LibreOffice instance {instance.index} ({reason}).")
+        instance.stop()
+        instance.start()
+
+    def convert(self, input_file: Path, output_pdf: Path):
+        instance = self.available.get()
+        try:
+            if instance.proc is None:
+                instance.start()
+            elif not instance.is_healthy():
+                self._restart(instance, "failed health check")
+            elif instance.converted >= self.recycle_after:
+                self._restart(instance, f"converted {instance.converted} documents")
+            instance.convert(input_file, output_pdf)
+        finally:
+            self.available.put(instance)
+
+    def close(self):
+        for instance in self.instances:
+            instance.stop()
+
+
+def get_libreoffice_pool() -> Optional[LibreOfficePool]:
+    """Return the shared LibreOffice pool, creating it on first use. None if the pool is disabled or unavailable."""
+    global LIBREOFFICE_POOL
+    if LIBREOFFICE_POOL is None and LIBREOFFICE_POOL_SIZE > 0:
+        if not _check_python_dependency("uno"):
+            logger.warning("The LibreOffice pool needs the 'uno' Python module (python3-uno), falling back to soffice commands.")
+            return None
+        LIBREOFFICE_POOL = LibreOfficePool(LIBREOFFICE_POOL_SIZE, LIBREOFFICE_POOL_RECYCLE, LIBREOFFICE_POOL_CONNECT_TIMEOUT)
+    return LIBREOFFICE_POOL
+
+
+def close_libreoffice_pool():
+    global LIBREOFFICE_POOL
+    if LIBREOFFICE_POOL is not None:
+        LIBREOFFICE_POOL.close()
+        LIBREOFFICE_POOL = None
+
+
+def get_spool_dir() -> Path:
+    """Return the directory where cups-pdf writes the PDFs of the lp jobs, creating it if needed."""
+    spool_dir = Path(CUPS_SPOOL_DIR).expanduser() if CUPS_SPOOL_DIR else Path.home() / "PDF"
+    spool_dir.mkdir(parents=True, exist_ok=True)
+    return spool_dir
+
+
+def _same_filesystem(path: Union[str, Path], other: Union[str, Path]) -> bool:
+    try:
+        return os.stat(path).st_dev == os.stat(other).st_dev
+    except OSError:
+        return False
+
+
+def _staging_dir(output_file: str) -> Path:
+    """Create a private directory next to `output_file`, so whatever is written there can be renamed into place."""
+    return Path(tempfile.mkdtemp(prefix=".printer-simulation-", dir=os.path.dirname(output_file) or "."))
+
+
+@traced("move_output")
+def _move_to_output(generated_pdf: Path, input_file: Path, output: Optional[str]) -> str:
+    """
+    Move a generated PDF to the location requested with --output and return its path.
+    The output only ever shows up complete: it is renamed into place, after copying it
+    next to the output first if the PDF was generated on another filesystem.
+    """
+    output_file = process_output(str(input_file), output)
+    if output_file == str(generated_pdf):
+        logger.debug(f"Generated PDF is already in the desired location: {output_file}.")
+        return output_file
+
+    try:
+        os.replace(generated_pdf, output_file)
+        logger.debug(f"Renamed generated PDF from {generated_pdf} to {output_file}.")
+        return output_file
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(output_file)}.", dir=os.path.dirname(output_file) or ".")
+    try:
+        with os.fdopen(fd, "wb") as dst, open(generated_pdf, "rb") as src:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        shutil.copystat(generated_pdf, tmp_path)
+        os.replace(tmp_path, output_file)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+    os.remove(generated_pdf)
+    logger.debug(f"Copied generated PDF from {generated_pdf} to {output_file} (different filesystem, see --spool-dir).")
+    return output_file
+
+
+@traced("convert")
+def convert_with_libreoffice(input_files: List[Path], outdir: Path, profile_dir: Optional[str] = None):
+    """
+    Convert one or more files to PDF with a single headless LibreOffice process.
+    A separate `profile_dir` is needed to run several conversions at the same time.
+    """
+    logger.debug(f"Converting {len(input_files)} file(s) to PDF using soffice command.")
+    profile_args = [f"-env:UserInstallation={Path(profile_dir).as_uri()}"] if profile_dir else []
+    subprocess.run([
+        "libreoffice"] + profile_args + [
+        "--headless", 
+        "--convert-to", 
+        "pdf", 
+        "--outdir", 
+        str(outdir)] + [str(f) for f in input_files], 
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
 
-    output_file = start_print_process_visually(file, output, is_firefox=True, debug=debug)
+def _split_libreoffice_batches(input_files: List[Path], batch_size: int) -> List[List[Path]]:
+    """
+    Split the files in batches of at most `batch_size` files.
+    LibreOffice names its outputs after the input stem, so two files with the same stem never share a batch.
+    """
+    batches: List[List[Path]] = []
+    stems: List[set] = []
+    for input_file in input_files:
+        for batch, batch_stems in zip(batches, stems, strict=True):
+            if len(batch) < batch_size and input_file.stem not in batch_stems:
+                batch.append(input_file)
+                batch_stems.add(input_file.stem)
+                break
+        else:
+            batches.append([input_file])
+            stems.append({input_file.stem})
+    return batches
 
-    return output_file, program_name
 
+def _convert_libreoffice_batch(
+    batch: List[Path],
+    output: Optional[str],
+    profile_dir: Optional[str] = None
+) -> Dict[str, Union[str, Exception]]:
+    """
+    Convert a batch in its own directory and route each PDF to its output. Returns the result of every file.
+    Every file of the batch goes to the same directory, and the batch is converted in a staging directory
+    inside it, so each PDF only has to be renamed.
+    """
+    started = time.monotonic_ns()
+    results: Dict[str, Union[str, Exception]] = {}
+    try:
+        batch_dir = _staging_dir(process_output(str(batch[0]), output))
+    except Exception as e:
+        logger.error(f"Could not create a staging directory for {len(batch)} file(s): {e}")
+        return {str(input_file): e for input_file in batch}
+    try:
+        with span("libreoffice_batch", files=len(batch), mode="invisible"):
+            convert_with_libreoffice(batch, batch_dir, profile_dir)
+            for input_file in batch:
+                generated_pdf = batch_dir / (input_file.stem + ".pdf")
+                if generated_pdf.exists():
+                    results[str(input_file)] = _move_to_output(generated_pdf, input_file, output)
+                else:
+                    logger.error(f"LibreOffice conversion did not produce the expected PDF file {generated_pdf}.")
+                    results[str(input_file)] = FileNotFoundError(f"LibreOffice conversion did not produce the expected PDF file {generated_pdf}.")
+    except Exception as e:
+        logger.error(f"LibreOffice conversion of {len(batch)} file(s) failed: {e}")
+        for input_file in batch:
+            results.setdefault(str(input_file), e)
+    finally:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+
+    if TRACER is not None:  # Every file of the batch is a job of its own, which lasted until its PDF was routed
+        for input_file in batch:
+            result = results[str(input_file)]
+            TRACER.add(
+                "job", started, job=str(input_file), file_type=get_mime_info(str(input_file))[0], mode="invisible",
+                error=type(result).__name__ if isinstance(result, Exception) else None
+            )
+    return results
 
-def open_pdf_linux(file: str, delay: Union[float, Tuple[float, float]], debug: bool = False):
-    logger.info(f"Opening generated PDF {file}.")
-    
-    global PRINT_PROGRAM_PROC
-    
-    # PRINT_PROGRAM_PROC = subprocess.Popen(["evince", file])  # FIXME: This is not working
-    PRINT_PROGRAM_PROC = subprocess.Popen(["firefox", "--new-window", file])
-    window_name = f"{file} — Mozilla Firefox".split("/")[-1]  # Get the last part of the path
-    wait_for_program(window_name, pid=PRINT_PROGRAM_PROC.pid)
-    logger.info(f"Simulating reading the PDF...")
-    sleep_action(delay)  # TODO: add actions such as zooming, scrolling, etc.
-
-    # Ensure the focus is on the evince window
-    # os.system("wmctrl -xa evince.Evince")
-
-    # Execute wmctrl -l and get the window list
-    res = subprocess.run(["wmctrl", "-l"], capture_output=True, text=True)
-    lines = res.stdout.splitlines()
-
-    # Busca la ventana que contenga el nombre especificado
-    for line in lines:
-        if window_name in line:
-            wid = line.split()[0]  # Get the window ID
-            # Cambia el foco a la ventana
-            subprocess.run(["wmctrl", "-ia", wid])
-            logger.debug(f"Changing focus to {window_name}.")
-            break
-    sleep(1)
 
-    # Close the evince/firefox window
-    input_key('Alt+F4', debug=debug)
-    close_failsafe(PRINT_PROGRAM_PROC)
-    sleep(1)
+def start_batch_print_process_invisibly(
+    files: List[str],
+    output: Optional[str],
+    batch_size: int = LIBREOFFICE_BATCH_SIZE,
+    jobs: int = 1,
+    debug: bool = False
+) -> Dict[str, Union[str, Exception]]:
+    """
+    Convert LibreOffice files to PDF in as few soffice runs as possible and route each PDF to its output.
+    Up to `jobs` soffice processes run at the same time, each one with its own profile.
+    Returns the output file (or the error) of every input file.
+    """
+    input_files = [Path(file).resolve() for file in files]
+    results: Dict[str, Union[str, Exception]] = {}
+
+    pool = get_libreoffice_pool()
+    if pool is not None:
+        def convert_in_pool(input_file: Path) -> Optional[str]:
+            staging_dir = None
+            try:
+                output_file = process_output(str(input_file), output)
+                # A conversion cut short by a crash or a timeout never leaves a truncated PDF at the output
+                staging_dir = _staging_dir(output_file)
+                generated_pdf = staging_dir / (input_file.stem + ".pdf")
+                with span("job", job=str(input_file), file_type=get_mime_info(str(input_file))[0], mode="invisible"):
+                    with span("convert"):
+                        pool.convert(input_file, generated_pdf)
+                    os.replace(generated_pdf, output_file)
+                logger.debug(f"Converted {input_file} to {output_file} in the LibreOffice pool.")
+                return output_file
+            except Exception as e:
+                logger.warning(f"LibreOffice pool failed to convert {input_file} ({e}), falling back to soffice command.")
+                return None
+            finally:
+                if staging_dir is not None:
+                    shutil.rmtree(staging_dir, ignore_errors=True)
+
+        with ThreadPoolExecutor(max_workers=pool.size) as executor:
+            pool_results = list(executor.map(convert_in_pool, input_files))
+        results.update({str(f): r for f, r in zip(input_files, pool_results, strict=True) if r is not None})
+        input_files = [f for f, r in zip(input_files, pool_results, strict=True) if r is None]
+
+    if not input_files:
+        return results
+
+    # Batches never mix output directories, so that each one is converted straight into its destination
+    output_dirs: Dict[str, List[Path]] = {}
+    for input_file in input_files:
+        try:
+            output_dir = os.path.dirname(process_output(str(input_file), output))
+        except ValueError as e:
+            results[str(input_file)] = e
+            continue
+        output_dirs.setdefault(output_dir, []).append(input_file)
+    input_files = [input_file for dir_files in output_dirs.values() for input_file in dir_files]
+    if not input_files:
+        return results
+
+    # Spread the files over the parallel soffice processes, without going over batch_size
+    jobs = max(1, min(jobs, len(input_files)))
+    batch_limit = min(batch_size, -(-len(input_files) // jobs))
+    batches = [batch for dir_files in output_dirs.values() for batch in _split_libreoffice_batches(dir_files, batch_limit)]
+
+    if jobs == 1:
+        for batch in batches:
+            results.update(_convert_libreoffice_batch(batch, output))
+        return results
+
+    # Concurrent soffice processes cannot share a profile, keep one per slot so it stays warm between runs
+    profiles = queue.Queue()
+    for slot in range(jobs):
+        profiles.put(os.path.join(CACHE_PATH, f"libreoffice-profile-{slot}"))
+
+    def convert_batch(batch: List[Path]) -> Dict[str, Union[str, Exception]]:
+        profile_dir = profiles.get()
+        try:
+            return _convert_libreoffice_batch(batch, output, profile_dir)
+        finally:
+            profiles.put(profile_dir)
 
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for batch_results in executor.map(convert_batch, batches):
+            results.update(batch_results)
+    return results
 
-def print_visually_linux(
-        files: List[str],
-        delay: Union[float, Tuple[float, float]],
-        output: Optional[str],
-        debug: bool = False
-    ):
-    global FILE_PROGRAM_PROC
-    
-    for file in files:
-        file = os.path.abspath(os.path.expanduser(file))
-        if os.path.isdir(file):  # Get random file if a dir is provided
-            file = get_random_file_from_dir(file)
-            if file is None:
-                return
 
-        # Get the program based on the MIME type of the file
-        mime_type = subprocess.run(['xdg-mime', 'query', 'filetype', file], capture_output=True, text=True).stdout.strip()
-        program = subprocess.run(['xdg-mime', 'query', 'default', mime_type], capture_output=True, text=True).stdout.strip()
-        logger.debug(f"File {file} has MIME type {mime_type} and default program {program}.")
-    
-        # Check if the file is an image
-        if "eog" in program or mime_type.startswith('image/'):
-            output_file, program = print_image_linux(file, output, debug)
-        # Check if the file is a LibreOffice file
-        elif "libreoffice" in program or mime_type in ['application/vnd.oasis.opendocument.text', 'application/vnd.oasis.opendocument.spreadsheet', 'application/vnd.oasis.opendocument.presentation', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'application/vnd.openxmlformats-officedocument.presentationml.presentation']:
-            logger.info(f"Printing LibreOffice file {file}.")
-            output_file, program = print_libreoffice_linux(file, output, debug)
-        # Check if the file is a PDF
-        elif "evince" in program or mime_type == 'application/pdf':
-            logger.info(f"Printing PDF file {file}.")
-            output_file, program = print_pdf_linux(file, output, debug)
-        # Check if the file a text file
-        else:
-            logger.info(f"Printing text file {file}.")
-            output_file, program = print_text_linux(file, output, debug)
-        # else:
-        #     output_file = ""
-
-        open_pdf_linux(output_file, delay, debug)
-
-        # Focus again on the original program
-        res = subprocess.run(["wmctrl", "-l"], capture_output=True, text=True)
-        lines = res.stdout.splitlines()
-        for line in lines:
-            if program in line:
-                wid = line.split()[0]  # Get the window ID
-                subprocess.run(["wmctrl", "-ia", wid])
-                logger.debug(f"Changing focus back to {program}.")
-                break
-        sleep(1)
-        
-        input_key('Alt+F4', debug=debug)  # Close the file viewer
-        close_failsafe(FILE_PROGRAM_PROC)
-        sleep(1)
+# Spool directory watcher
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class SpoolWatcher:
+    """
+    Watch a directory for finished files (IN_CLOSE_WRITE / IN_MOVED_TO) with inotify.
+    Falls back to scanning the directory every SPOOL_POLL_INTERVAL seconds on systems or
+    filesystems without inotify support. Must be started before the job that writes the file.
+    """
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.fd: Optional[int] = None
+        self.snapshot: Dict[str, int] = {}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self):
+        import ctypes
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+            if libc.inotify_add_watch(fd, os.fsencode(self.directory), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+                error = ctypes.get_errno()
+                os.close(fd)
+                raise OSError(error, "inotify_add_watch failed")
+            self.fd = fd
+            logger.debug(f"Watching {self.directory} with inotify.")
+        except (OSError, AttributeError) as e:
+            logger.debug(f"inotify not available for {self.directory} ({e}), falling back to polling.")
+            self.snapshot = self._scan()
+
+    def _scan(self) -> Dict[str, int]:
+        with os.scandir(self.directory) as entries:
+            return {entry.name: entry.stat().st_mtime_ns for entry in entries if entry.is_file()}
+
+    def _read_events(self, timeout: float) -> List[str]:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        names = []
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = _INOTIFY_EVENT.unpack_from(data, offset)
+            offset += _INOTIFY_EVENT.size
+            names.append(data[offset:offset + length].rstrip(b"\0").decode(errors="replace"))
+            offset += length
+        return names
+
+    def _poll_changes(self, timeout: float) -> List[str]:
+        sleep(timeout)
+        current = self._scan()
+        changed = [name for name, mtime in current.items() if self.snapshot.get(name) != mtime]
+        self.snapshot = current
+        return changed
+
+    def wait_for(self, match: Callable[[str], bool], timeout: float = SPOOL_WAIT_TIMEOUT) -> Optional[Path]:
+        """
+        Return the first finished file whose name satisfies `match`, or None after `timeout` seconds.
+        The file is claimed by renaming it, so concurrent jobs waiting for the same name never take the same file.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            if self.fd is not None:
+                names = self._read_events(remaining)
+            else:
+                names = self._poll_changes(min(remaining, SPOOL_POLL_INTERVAL))
+            for name in names:
+                if name.startswith(".claimed-") or not match(name):
+                    logger.debug(f"Ignoring {name} in {self.directory}.", extra={"rate_limit": "spool"})
+                    continue
+                claimed = self.directory / f".claimed-{os.getpid()}-{threading.get_ident()}-{name}"
+                try:
+                    os.rename(self.directory / name, claimed)
+                except FileNotFoundError:
+                    continue  # Taken by another job
+                return claimed
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
 
 
 def start_print_process_invisibly(
@@ -656,156 +3089,229 @@ def start_print_process_invisibly(
     debug: bool = False
 ) -> str:
     input_file = Path(file).resolve()
-    pdf_dir = Path.home() / "PDF"
-    pdf_dir.mkdir(exist_ok=True)
 
     if is_libreoffice:
-        logger.debug("Converting LibreOffice file to PDF using soffice command.")
-        subprocess.run([
-            "libreoffice", 
-            "--headless", 
-            "--convert-to", 
-            "pdf", 
-            "--outdir", 
-            str(pdf_dir), 
-            str(input_file)], 
-            check=True,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL
-        )
+        # Convert next to the output, so that it only has to be renamed
+        staging_dir = _staging_dir(process_output(str(input_file), output))
+        try:
+            convert_with_libreoffice([input_file], staging_dir)
 
-        output_file = process_output(str(input_file), output)
-        generated_pdf = pdf_dir / (input_file.stem + ".pdf")
-        if generated_pdf.exists():
-            if output_file != str(generated_pdf):
-                shutil.move(str(generated_pdf), output_file)
-                logger.debug(f"Moved generated PDF from {generated_pdf} to {output_file}.")
+            generated_pdf = staging_dir / (input_file.stem + ".pdf")
+            if generated_pdf.exists():
+                return _move_to_output(generated_pdf, input_file, output)
             else:
-                logger.debug(f"Generated PDF is already in the desired location: {output_file}.")
-            return output_file
-        else:
-            raise FileNotFoundError(f"LibreOffice conversion did not produce the expected PDF file {generated_pdf}.")
-
-    # Get existing PDF files in the PDF directory
-    existing_pdfs = set(pdf_dir.glob("*.pdf"))
-    logger.debug(f"Existing PDF files in {pdf_dir}: {[str(p) for p in existing_pdfs]}.")
-
-    # Start the printing process
-    subprocess.run(
-        ["lp", "-d", "PDF",  str(input_file)],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL,
-        check=True
-    )
+                raise FileNotFoundError(f"LibreOffice conversion did not produce the expected PDF file {generated_pdf}.")
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    pdf_dir = get_spool_dir()
+
+    # cups-pdf names the PDF after the job title. A unique title tells the PDF of this job apart from the
+    # ones of concurrent jobs, even when a file name contains another (a.txt and ba.txt)
+    import uuid
+    token = uuid.uuid4().hex
+    job_title = f"{input_file.stem}-{token}"
+
+    # Watch the PDF directory before printing so the finished file cannot be missed
+    with SpoolWatcher(pdf_dir) as watcher:
+        # Start the printing process
+        with span("lp"):
+            subprocess.run(
+                ["lp", "-d", "PDF", "-t", job_title, str(input_file)],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                check=True
+            )
 
-    # Wait for a new PDF file to appear in the PDF directory
-    new_pdf = None
-    timeout = 5  # iterations
-    logger.debug(f"Waiting for the new PDF file to appear in {pdf_dir}...")
-    for _ in range(timeout):
-        sleep(1)  # wait for 1 second before checking again
-        current_pdfs = set(pdf_dir.glob("*.pdf"))
-        # print(f"Current PDF files in {pdf_dir}: {[str(p) for p in current_pdfs]}")
-        new_files = current_pdfs - existing_pdfs
-        logger.debug(f"New PDF files detected: {[str(p) for p in new_files]}.")
-        # print(f"Raw new files: {new_files}")
-        # print(f"Type of new_files: {type(new_files)}")
-
-        # Filter possible candidates based on the input file name
-        # for f in new_files:
-        #     print(f"Checking new file {f} with name {f.name}")
-        #     print(f"Is {f.name} equal to {input_file.name}? Is {str(f)} equal to {input_file}?")
-        #     print()
-        candidates = [f for f in new_files if input_file.name in f.name]
-        logger.debug(f"Filtered candidates based on input file name: {[str(p) for p in candidates]}.")
-        if candidates:
-            # Take the most recently modified candidate
-            new_pdf = max(candidates, key=lambda f: f.stat().st_mtime)
-            logger.debug(f"Selected new PDF file: {new_pdf}.")
-            break
-        print()
+        # Wait for a PDF named after the input file to be written in the PDF directory
+        logger.debug(f"Waiting for the new PDF file to appear in {pdf_dir}...")
+        start_t = time.monotonic()
+        with span("spool_wait"):
+            new_pdf = watcher.wait_for(
+                lambda name: name.endswith(".pdf") and token in name,
+                timeout=SPOOL_WAIT_TIMEOUT
+            )
+        if new_pdf is not None:
+            logger.debug(f"Selected new PDF file: {new_pdf} (after {time.monotonic() - start_t:.2f} seconds).")
 
     if new_pdf is None:
-        raise FileNotFoundError(f"No new PDF file was created in the PDF directory for input file {file}.")
+        raise FileNotFoundError(f"No new PDF file was created in the PDF directory for input file {file} after {SPOOL_WAIT_TIMEOUT} seconds.")
     
-    # Check what output is: directory or filename
-    output_file = process_output(str(input_file), output)
-
     # Move the new PDF to the desired output location
-    if output_file != str(new_pdf):
-        shutil.move(str(new_pdf), output_file)
-        logger.debug(f"Moved generated PDF from {new_pdf} to {output_file}.")
-    else:
-        logger.debug(f"Generated PDF is already in the desired location: {output_file}.")
-    
-    return output_file
+    return _move_to_output(new_pdf, input_file, output)
 
 
 
 def print_invisibly_linux(
     files: List[str],
     output: Optional[str],
+    batch_size: int = LIBREOFFICE_BATCH_SIZE,
+    jobs: int = 1,
+    libreoffice_jobs: Optional[int] = None,
+    cups_jobs: Optional[int] = None,
     debug: bool = False
-):
+) -> Dict[str, Exception]:
+    """
+    Print files without the GUI, handling up to `jobs` files at the same time.
+    `libreoffice_jobs` and `cups_jobs` limit the concurrency of each backend (both default to `jobs`).
+    Errors are collected per file instead of stopping the batch. Returns the failed files and their errors.
+    """
+    results: Dict[str, Union[str, Exception]] = {}
+    resolved_files = []
     for file in files:
         file = os.path.abspath(os.path.expanduser(file))
         if os.path.isdir(file):  # Get random file if a dir is provided
-            file = get_random_file_from_dir(file)
+            dir = file
+            file = get_random_file_from_dir(dir)
             if file is None:
-                return
+                results[dir] = FileNotFoundError(f"No file to print in {dir}.")
+                continue
+        resolved_files.append(file)
 
-        # Get the program based on the MIME type of the file
-        mime_type = subprocess.run(['xdg-mime', 'query', 'filetype', file], capture_output=True, text=True).stdout.strip()
-        program = subprocess.run(['xdg-mime', 'query', 'default', mime_type], capture_output=True, text=True).stdout.strip()
-        logger.debug(f"File {file} has MIME type {mime_type} and default program {program}.")
+    jobs = max(1, jobs)
+    libreoffice_jobs = jobs if libreoffice_jobs is None else max(1, libreoffice_jobs)
+    cups_slots = threading.Semaphore(jobs if cups_jobs is None else max(1, cups_jobs))
 
-        # Check if the file is a LibreOffice file
-        if "libreoffice" in program or mime_type in ['application/vnd.oasis.opendocument.text', 'application/vnd.oasis.opendocument.spreadsheet', 'application/vnd.oasis.opendocument.presentation', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'application/vnd.openxmlformats-officedocument.presentationml.presentation']:
-            logger.info(f"Printing LibreOffice file {file}.")
-            output_file = start_print_process_invisibly(file, output, is_libreoffice=True, debug=debug)
-        else:
+    def print_with_lp(file: str, mime_type: str) -> Union[str, Exception]:
+        with cups_slots, span("job", job=file, file_type=mime_type, mode="invisible"):
             logger.info(f"Printing file {file} using lp command.")
-            output_file = start_print_process_invisibly(file, output, debug=debug)
+            try:
+                return start_print_process_invisibly(file, output, debug=debug)
+            except Exception as e:
+                logger.error(f"Printing {file} failed: {e}")
+                return e
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        # Get the program based on the MIME type of the files
+        mime_infos = list(executor.map(get_mime_info, resolved_files))
+
+        # Check which files are LibreOffice files
+        libreoffice_files = []
+        other_files = {}
+        for file, (mime_type, program) in zip(resolved_files, mime_infos, strict=True):
+            if is_libreoffice_file(mime_type, program):
+                libreoffice_files.append(file)
+            else:
+                other_files[file] = mime_type
+
+        # Hash the inputs up front, files with the same content as a previous render are not rendered again
+        cache = get_render_cache()
+        if cache is not None:
+            keys = dict(zip(resolved_files, executor.map(
+                lambda file: cache.key(file, "libreoffice" if file not in other_files else "cups"), resolved_files
+            ), strict=True))
+            lp_groups: Dict[str, Dict[str, Optional[str]]] = {}  # Files with the same content go to the same job
+            for file in other_files:
+                lp_groups.setdefault(keys[file] or file, {})[file] = keys[file]
+
+        def print_group(files: List[str]) -> Dict[str, Union[str, Exception]]:
+            return {file: print_with_lp(file, other_files[file]) for file in files}
+
+        def convert_libreoffice_files(files: List[str]) -> Dict[str, Union[str, Exception]]:
+            logger.info(f"Printing {len(files)} LibreOffice file(s): {', '.join(files)}.")
+            return start_batch_print_process_invisibly(files, output, batch_size=batch_size, jobs=libreoffice_jobs, debug=debug)
+
+        # LibreOffice files are converted together to pay the soffice startup only once per batch
+        libreoffice_future = None
+        if libreoffice_files:
+            if cache is not None:
+                libreoffice_future = executor.submit(
+                    _render_with_cache, cache, {file: keys[file] for file in libreoffice_files}, output, convert_libreoffice_files
+                )
+            else:
+                libreoffice_future = executor.submit(convert_libreoffice_files, libreoffice_files)
+
+        for file in other_files:  # Probe with the first file that has a valid output
+            try:
+                output_dir = os.path.dirname(process_output(file, output))
+            except Exception:
+                continue  # The job of the file records the error
+            if not _same_filesystem(get_spool_dir(), output_dir):
+                logger.info(
+                    f"The CUPS spool directory {get_spool_dir()} is not on the filesystem of {output_dir}, every PDF will be copied. "
+                    "Point the Out setting of cups-pdf and --spool-dir to a directory on that filesystem to rename them instead."
+                )
+            break
+
+        if cache is not None:
+            for future in [executor.submit(_render_with_cache, cache, group, output, print_group) for group in lp_groups.values()]:
+                results.update(future.result())
+        else:
+            lp_futures = {file: executor.submit(print_with_lp, file, mime_type) for file, mime_type in other_files.items()}
+            for file, future in lp_futures.items():
+                results[file] = future.result()
+        if libreoffice_future is not None:
+            results.update(libreoffice_future.result())
 
         # open_pdf_linux(output_file, delay, debug)  # Not needed in invisible mode
 
+    if cache is not None:
+        cache.trim()
+
+    errors = {file: result for file, result in results.items() if isinstance(result, Exception)}
+    if errors:
+        logger.error(f"{len(errors)} of {len(results)} file(s) could not be printed:")
+        for file, error in errors.items():
+            logger.error(f"  {file}: {error}")
+    return errors
+
 
 def print_in_linux(
         visible: bool, 
         files: List[str],
         delay: Union[float, Tuple[float, float]],
-        output: Optional[str]
-    ):
+        output: Optional[str],
+        batch_size: int = LIBREOFFICE_BATCH_SIZE,
+        jobs: int = 1,
+        libreoffice_jobs: Optional[int] = None,
+        cups_jobs: Optional[int] = None
+    ) -> Dict[str, Exception]:
+    """Print the files visually or invisibly. Returns the files that could not be printed (invisible mode only)."""
     if visible:
         logger.debug(f"Trying to acquire input lock on {LOCK_INPUT.lock_file}.")
         start_t = time.perf_counter()
-        with LOCK_INPUT.acquire():
-            waited_t = time.perf_counter() - start_t
-            if waited_t > CONTENTION_THRESHOLD:
-                logger.debug(f"Input lock acquired after waiting {waited_t:.2f} seconds (contention detected).")
-            else:
-                logger.debug(f"Input lock acquired immediately (no contention).")
-            
-            disable_user_input()
-            
-            logger.debug(f"Trying to acquire lock on {LOCK.lock_file}.")
-            start_t = time.perf_counter()
-            with LOCK.acquire():
+        try:
+            with LOCK_INPUT_QUEUE.acquire(timeout=LOCK_TIMEOUT, priority=LOCK_PRIORITY):
                 waited_t = time.perf_counter() - start_t
                 if waited_t > CONTENTION_THRESHOLD:
-                    logger.debug(f"Lock acquired after waiting {waited_t:.2f} seconds (contention detected).")
+                    logger.debug(f"Input lock acquired after waiting {waited_t:.2f} seconds (contention detected).")
                 else:
-                    logger.debug(f"Lock acquired immediately (no contention).")
-                    
-                print_visually_linux(files, delay, output)
-                enable_user_input()
+                    logger.debug(f"Input lock acquired immediately (no contention).")
+                
+                disable_user_input()
+                try:
+                    logger.debug(f"Trying to acquire lock on {LOCK.lock_file}.")
+                    start_t = time.perf_counter()
+                    with LOCK_QUEUE.acquire(timeout=LOCK_TIMEOUT, priority=LOCK_PRIORITY):
+                        waited_t = time.perf_counter() - start_t
+                        if waited_t > CONTENTION_THRESHOLD:
+                            logger.debug(f"Lock acquired after waiting {waited_t:.2f} seconds (contention detected).")
+                        else:
+                            logger.debug(f"Lock acquired immediately (no contention).")
+
+                        try:
+                            start_input_session()
+                            print_visually_linux(files, delay, output)
+                        finally:
+                            close_app_instances()
+                            REAPER.shutdown()
+                            stop_input_session()
+                finally:
+                    enable_user_input()
+        except Timeout as e:
+            logger.error(f"Could not acquire {e.lock_file} within {LOCK_TIMEOUT} seconds, giving up.")
+            return {file: e for file in files}
+        return {}
     else:
-        print_invisibly_linux(files, output)
+        return print_invisibly_linux(
+            files, output, batch_size=batch_size,
+            jobs=jobs, libreoffice_jobs=libreoffice_jobs, cups_jobs=cups_jobs
+        )
 
 
 # Input control
 
-def get_user_input_device_ids():
+def _query_user_input_device_ids() -> List[int]:
     EXCLUDED_KEYWORDS = [
         "Virtual core",
         "XTEST",
@@ -839,28 +3345,99 @@ def get_user_input_device_ids():
     return device_ids
 
 
+def _input_devices_key() -> dict:
+    """Return what identifies the current device set: the X server and the last hotplug under /dev/input."""
+    display = os.environ.get("DISPLAY", "")
+    try:
+        x_socket = os.stat(f"/tmp/.X11-unix/X{display.lstrip(':').split('.')[0]}").st_ino
+    except (OSError, ValueError):
+        x_socket = None
+    try:
+        hotplug = os.stat("/dev/input").st_mtime_ns
+    except OSError:
+        hotplug = None
+    return {"display": display, "x_socket": x_socket, "hotplug": hotplug}
+
+
+def get_user_input_device_ids(refresh: bool = False) -> List[int]:
+    """Return the user input devices, cached until the X server changes or a device is plugged or unplugged."""
+    cache_file = os.path.join(CACHE_PATH, "input-devices.json")
+    key = _input_devices_key()
+    cache = None if refresh else _read_json(cache_file)
+    if cache is not None and cache.get("key") == key:
+        return cache["ids"]
+
+    device_ids = _query_user_input_device_ids()
+    try:
+        _write_json(cache_file, {"key": key, "ids": device_ids})
+    except OSError as e:
+        logger.debug(f"Could not cache the input devices: {e}")
+    return device_ids
+
+
+def _disabled_input_devices() -> Optional[set]:
+    """Return the IDs of the disabled devices according to 'xinput list --long', or None if it cannot be queried."""
+    try:
+        result = subprocess.run(["xinput", "list", "--long"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    except OSError:
+        return None
+    if result.returncode != 0:
+        return None
+
+    disabled = set()
+    device_id = None
+    for line in result.stdout.splitlines():
+        match = re.search(r'id=(\d+)', line)
+        if match:
+            device_id = int(match.group(1))
+        elif device_id is not None and "This device is disabled" in line:
+            disabled.add(device_id)
+    return disabled
+
+
 def _set_input_devices(enabled: bool):
     """
     Enable or disable user input devices using xinput.
+    All devices are switched at the same time and the new state is confirmed with a single query
+    instead of sleeping a fixed time.
     """
-    # USER_INPUT_DEVICE_IDS = [9, 10, 11]
-    
     action = "enable" if enabled else "disable"
-    for dev_id in get_user_input_device_ids():
+    device_ids = get_user_input_device_ids()
+
+    procs = []
+    for dev_id in device_ids:
         try:
-            res = subprocess.run(
+            procs.append((dev_id, subprocess.Popen(
                 ["xinput", action, str(dev_id)],
                 stdout=subprocess.DEVNULL,
                 stderr=subprocess.PIPE,
                 text=True
-            )
-            logger.debug(f"xinput {action} {dev_id}")
-            if res.returncode != 0:
-                logger.warning(f"xinput non-zero return code: {res.returncode}")
-                logger.error(f"xinput error: {res.stderr}")
+            )))
         except Exception as e:
             logger.error(f"Failed to {action} device {dev_id}: {e}")
-    sleep(2)  # Fail-safe
+
+    stale = False
+    for dev_id, proc in procs:
+        _, stderr = proc.communicate()
+        logger.debug(f"xinput {action} {dev_id}")
+        if proc.returncode != 0:
+            logger.warning(f"xinput non-zero return code: {proc.returncode}")
+            logger.error(f"xinput error: {stderr}")
+            stale = True
+    if stale:  # A device may have disappeared, query the device set again next time
+        get_user_input_device_ids(refresh=True)
+
+    start = time.monotonic()
+    while True:
+        disabled = _disabled_input_devices()
+        pending = None if disabled is None else [d for d in device_ids if (d in disabled) == enabled]
+        if pending == []:
+            logger.debug(f"Input devices {action}d after {time.monotonic() - start:.2f} seconds.")
+            return
+        if time.monotonic() - start > INPUT_TOGGLE_TIMEOUT:
+            logger.warning(f"Could not confirm that input devices {pending if pending is not None else device_ids} are {action}d.")
+            return
+        sleep(0.05)
 
 
 def disable_user_input():
@@ -881,7 +3458,7 @@ def init(check_display: bool = False):
     _setup_locks()
 
 
-def main():
+def _build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         prog='printer-simulation',
         description='Simulate activity printing diffent types of files, such as text files, images, etc.',
@@ -895,96 +3472,615 @@ def main():
     parser.add_argument('--min-delay', type=float, default=None, help='Minimum delay between actions (in seconds).')
     parser.add_argument('--max-delay', type=float, default=None, help='Maximum delay between actions (in seconds).')
     parser.add_argument('--delay', type=float, default=None, help='Fixed delay between actions (in seconds). Overrides --min-delay and --max-delay.')
+    parser.add_argument('--window-timeout', type=float, default=WINDOW_WAIT_TIMEOUT, help=f'Maximum time to wait for a program window to show up (in seconds). Default: {WINDOW_WAIT_TIMEOUT}.')
+    parser.add_argument('--window-settle', type=float, default=WINDOW_SETTLE_DELAY, help=f'Extra time to wait once a program window is mapped (in seconds). Default: {WINDOW_SETTLE_DELAY}.')
+    parser.add_argument('--press-interval', type=float, default=INPUT_PRESS_INTERVAL, help=f'Human pacing in the print dialog: time between key presses (in seconds). Default: {INPUT_PRESS_INTERVAL}.')
+    parser.add_argument('--typing-interval', type=float, default=INPUT_TYPING_INTERVAL, help=f'Human pacing in the print dialog: time between typed characters (in seconds). Default: {INPUT_TYPING_INTERVAL}.')
+    parser.add_argument('--reuse-apps', action='store_true', help='In visible mode, keep one instance of each application for the whole run and open every file in it.')
+    parser.add_argument('--max-docs-per-app', type=int, default=MAX_DOCS_PER_APP, help=f'Documents opened in a reused application instance before restarting it, to bound its memory. Default: {MAX_DOCS_PER_APP}.')
+    parser.add_argument('--pipeline', action='store_true', help='In visible mode, launch the program of the next file while the output of the current one is being read.')
+    parser.add_argument('--batch-size', type=int, default=LIBREOFFICE_BATCH_SIZE, help=f'Maximum number of files converted by a single LibreOffice run in invisible mode. Default: {LIBREOFFICE_BATCH_SIZE}.')
+    parser.add_argument('--libreoffice-pool', type=int, default=LIBREOFFICE_POOL_SIZE, help='Number of warm headless LibreOffice instances used for conversions in invisible mode (needs python3-uno). 0 disables the pool.')
+    parser.add_argument('--libreoffice-recycle', type=int, default=LIBREOFFICE_POOL_RECYCLE, help=f'Documents converted by a pooled LibreOffice instance before restarting it. Default: {LIBREOFFICE_POOL_RECYCLE}.')
+    parser.add_argument('--libreoffice-connect-timeout', type=float, default=LIBREOFFICE_POOL_CONNECT_TIMEOUT, help=f'Seconds to wait for a pooled LibreOffice instance to accept connections when it starts. Default: {LIBREOFFICE_POOL_CONNECT_TIMEOUT}.')
+    parser.add_argument('--spool-timeout', type=float, default=SPOOL_WAIT_TIMEOUT, help=f'Maximum time to wait for CUPS to write the PDF of a job in invisible mode (in seconds). Default: {SPOOL_WAIT_TIMEOUT}.')
+    parser.add_argument('--spool-dir', type=str, default=CUPS_SPOOL_DIR, help='Directory where cups-pdf writes the PDFs (the Out setting of cups-pdf.conf). Keep it on the filesystem of --output so that the PDFs are renamed instead of copied. Default: ~/PDF.')
+    parser.add_argument('--render-cache', action='store_true', help='In invisible mode, reuse the PDFs rendered for files with the same content, and render each content only once across concurrent processes.')
+    parser.add_argument('--render-cache-size', type=int, default=RENDER_CACHE_MAX_SIZE, help=f'Maximum size of the render cache (in MiB), the least recently used PDFs are evicted first. Default: {RENDER_CACHE_MAX_SIZE}.')
+    parser.add_argument('--jobs', '-j', type=int, default=INVISIBLE_JOBS, help=f'Number of files handled concurrently in invisible mode. Default: {INVISIBLE_JOBS}.')
+    parser.add_argument('--libreoffice-jobs', type=int, default=None, help='Maximum number of concurrent LibreOffice conversions in invisible mode. Defaults to --jobs.')
+    parser.add_argument('--cups-jobs', type=int, default=None, help='Maximum number of concurrent CUPS (lp) jobs in invisible mode. Defaults to --jobs.')
+    parser.add_argument('--dir-index', action='store_true', help='Keep a persisted index of the directories passed as files, refreshed when their modification time changes.')
+    parser.add_argument('--no-repeat', action='store_true', help='When picking random files from a directory, do not repeat files printed in previous runs until all of them have been printed.')
+    parser.add_argument('--lock-timeout', type=float, default=LOCK_TIMEOUT, help='Maximum time to wait for the printer and input locks in visible mode (in seconds). 0 only tries once. By default, waits forever.')
+    parser.add_argument('--priority', type=int, default=LOCK_PRIORITY, help=f'Priority in the lock queues, higher values are served first. Default: {LOCK_PRIORITY}.')
+    parser.add_argument('--trace', type=str, default=None, help='Append the timed phases of every job to this file as JSON lines, and log a timing summary at the end.')
+    parser.add_argument('--trace-chrome', type=str, default=None, help='Write the timed phases of every job to this file in Chrome trace format (chrome://tracing, ui.perfetto.dev).')
+    parser.add_argument('--log-json', action='store_true', help='Also write the log as JSON lines (printer-simulation.jsonl, next to the log file).')
     parser.add_argument('--debug', action='store_true', help='Enable debug mode.')
+    return parser
 
-    # Parse arguments
-    args, unknown = parser.parse_known_args()
 
-    if args.debug:
+def _setup_console_logging(debug: bool):
+    if debug:
         console_handler.setFormatter(formatter)
     else:
         console_handler.setFormatter(LevelBasedFormatter())
         console_handler.setLevel(logging.INFO)
 
-    logger.info("Starting printer-simulation.")
-    if unknown:
-        logger.warning(f"Unknown arguments ignored: {unknown}")
 
-    init(check_display=bool(args.visible))
-    
-    try:
-        logger.debug(f"Printing will be {'visible' if args.visible else 'invisible'}.")
-
-        output_check = os.path.abspath(os.path.expanduser(args.output)) if args.output is not None else None
-        if output_check and not os.path.isdir(output_check) and len(args.files) > 1:
-            logger.error("If multiple files are provided, the output must be a directory.")
-            exit(1)
-
-        if args.visible:
-            # Visible mode
-            if args.min_delay is None and args.max_delay is None and args.delay is None:
-                args.min_delay = 5.0
-                args.max_delay = 10.0
-                delay = (args.min_delay, args.max_delay)
-                logger.info("No delay provided, using default min-delay=5.0 and max-delay=10.0 seconds.")
-            elif args.delay is not None:
+# Options that _apply_args keeps in module globals, shared by every job running in the process
+GLOBAL_OPTIONS = (
+    'window_timeout', 'window_settle', 'press_interval', 'typing_interval', 'reuse_apps', 'max_docs_per_app',
+    'pipeline', 'log_json', 'libreoffice_pool', 'libreoffice_recycle', 'libreoffice_connect_timeout', 'spool_timeout',
+    'spool_dir', 'render_cache', 'render_cache_size', 'dir_index', 'no_repeat', 'lock_timeout', 'priority', 'trace',
+    'trace_chrome',
+)
+
+
+def _apply_args(args: argparse.Namespace):
+    """Set the tuning globals (GLOBAL_OPTIONS) from the parsed command line arguments."""
+    global WINDOW_WAIT_TIMEOUT, WINDOW_SETTLE_DELAY, LIBREOFFICE_POOL_SIZE, LIBREOFFICE_POOL_RECYCLE, LIBREOFFICE_POOL_CONNECT_TIMEOUT
+    global SPOOL_WAIT_TIMEOUT
+    global DIR_INDEX, NO_REPEAT, LOCK_TIMEOUT, LOCK_PRIORITY, TRACER, INPUT_PRESS_INTERVAL, INPUT_TYPING_INTERVAL
+    global REUSE_APPS, MAX_DOCS_PER_APP, VISUAL_PIPELINE, CUPS_SPOOL_DIR, RENDER_CACHE, RENDER_CACHE_MAX_SIZE
+
+    WINDOW_WAIT_TIMEOUT = args.window_timeout
+    WINDOW_SETTLE_DELAY = args.window_settle
+    INPUT_PRESS_INTERVAL = args.press_interval
+    INPUT_TYPING_INTERVAL = args.typing_interval
+    REUSE_APPS = args.reuse_apps
+    MAX_DOCS_PER_APP = max(1, args.max_docs_per_app)
+    VISUAL_PIPELINE = args.pipeline
+    if args.log_json:
+        enable_json_log()
+    LIBREOFFICE_POOL_SIZE = args.libreoffice_pool
+    LIBREOFFICE_POOL_RECYCLE = args.libreoffice_recycle
+    LIBREOFFICE_POOL_CONNECT_TIMEOUT = args.libreoffice_connect_timeout
+    SPOOL_WAIT_TIMEOUT = args.spool_timeout
+    CUPS_SPOOL_DIR = args.spool_dir
+    RENDER_CACHE = args.render_cache
+    RENDER_CACHE_MAX_SIZE = max(0, args.render_cache_size)
+    DIR_INDEX = args.dir_index
+    NO_REPEAT = args.no_repeat
+    LOCK_TIMEOUT = args.lock_timeout
+    LOCK_PRIORITY = args.priority
+
+    # Jobs of the same run (scheduled or daemon jobs) keep adding to the current tracer
+    trace_paths = tuple(os.path.abspath(p) if p else None for p in (args.trace, args.trace_chrome))
+    if any(trace_paths) and (TRACER is None or (TRACER.jsonl_path, TRACER.chrome_path) != trace_paths):
+        finish_tracing()
+        TRACER = Tracer(*trace_paths)
+
+
+def run_job(args: argparse.Namespace) -> Dict[str, Exception]:
+    """Validate the job arguments and print the files. Returns the files that could not be printed."""
+    logger.debug(f"Printing will be {'visible' if args.visible else 'invisible'}.")
+
+    output_check = os.path.abspath(os.path.expanduser(args.output)) if args.output is not None else None
+    if output_check and not os.path.isdir(output_check) and len(args.files) > 1:
+        logger.error("If multiple files are provided, the output must be a directory.")
+        exit(1)
+
+    if args.visible:
+        # Visible mode
+        if args.min_delay is None and args.max_delay is None and args.delay is None:
+            args.min_delay = 5.0
+            args.max_delay = 10.0
+            delay = (args.min_delay, args.max_delay)
+            logger.info("No delay provided, using default min-delay=5.0 and max-delay=10.0 seconds.")
+        elif args.delay is not None:
+            if args.delay < 0:
+                logger.error("Delay must be a positive number.")
+                exit(1)
+            
+            if args.min_delay is not None or args.max_delay is not None:
+                logger.warning("Both delay and min-delay/max-delay provided, using delay and ignoring min-delay and max-delay.")
+            
+            args.min_delay = None
+            args.max_delay = None
+            delay = args.delay
+        else:
+            if args.min_delay is None and args.max_delay is not None:
+                args.delay = args.max_delay
+                args.max_delay = None
                 if args.delay < 0:
-                    logger.error("Delay must be a positive number.")
+                    logger.error("Max delay must be a positive number.")
                     exit(1)
-                
-                if args.min_delay is not None or args.max_delay is not None:
-                    logger.warning("Both delay and min-delay/max-delay provided, using delay and ignoring min-delay and max-delay.")
-                
+                logger.warning(f"Only max-delay provided, using delay={args.delay} seconds.")
+                delay = args.delay
+            elif args.min_delay is not None and args.max_delay is None:
+                args.delay = args.min_delay
                 args.min_delay = None
-                args.max_delay = None
+                if args.delay < 0:
+                    logger.error("Min delay must be a positive number.")
+                    exit(1)
+                logger.warning(f"Only min-delay provided, using delay={args.delay} seconds.")
                 delay = args.delay
             else:
-                if args.min_delay is None and args.max_delay is not None:
-                    args.delay = args.max_delay
-                    args.max_delay = None
-                    if args.delay < 0:
-                        logger.error("Max delay must be a positive number.")
-                        exit(1)
-                    logger.warning(f"Only max-delay provided, using delay={args.delay} seconds.")
-                    delay = args.delay
-                elif args.min_delay is not None and args.max_delay is None:
+                if args.min_delay < 0 or args.max_delay < 0:
+                    logger.error("Min and max delay must be positive numbers.")
+                    exit(1)
+                elif args.min_delay == args.max_delay:
                     args.delay = args.min_delay
                     args.min_delay = None
-                    if args.delay < 0:
-                        logger.error("Min delay must be a positive number.")
-                        exit(1)
-                    logger.warning(f"Only min-delay provided, using delay={args.delay} seconds.")
+                    args.max_delay = None
+                    logger.info(f"Min-delay and max-delay are the same, using delay={args.delay} seconds.")
                     delay = args.delay
+                elif args.min_delay > args.max_delay:
+                    logger.error("Min delay must be less than or equal to max delay.")
+                    exit(1)
                 else:
-                    if args.min_delay < 0 or args.max_delay < 0:
-                        logger.error("Min and max delay must be positive numbers.")
-                        exit(1)
-                    elif args.min_delay == args.max_delay:
-                        args.delay = args.min_delay
-                        args.min_delay = None
-                        args.max_delay = None
-                        logger.info(f"Min-delay and max-delay are the same, using delay={args.delay} seconds.")
-                        delay = args.delay
-                    elif args.min_delay > args.max_delay:
-                        logger.error("Min delay must be less than or equal to max delay.")
-                        exit(1)
-                    else:
-                        delay = (args.min_delay, args.max_delay)
-            logger.debug(f"Using delay: {delay} seconds.")
-        else:
-            # Invisible mode
-            if args.delay is not None or args.min_delay is not None or args.max_delay is not None:
-                logger.warning("Delay arguments are ignored in invisible mode.")
-            delay = 0.0  # No delay needed in invisible mode
-        
-        # Check the OS
-        if get_system() == 'Windows':
-            logger.debug("Running in Windows.")
-            print_in_windows(args.visible, args.files, args.min_delay, args.max_delay, args.delay, args.output)
-        else:
-            logger.debug("Running in Linux.")
-            print_in_linux(args.visible, args.files, delay, args.output)
+                    delay = (args.min_delay, args.max_delay)
+        logger.debug(f"Using delay: {delay} seconds.")
+    else:
+        # Invisible mode
+        if args.delay is not None or args.min_delay is not None or args.max_delay is not None:
+            logger.warning("Delay arguments are ignored in invisible mode.")
+        delay = 0.0  # No delay needed in invisible mode
+    
+    # Check the OS
+    if get_system() == 'Windows':
+        logger.debug("Running in Windows.")
+        print_in_windows(args.visible, args.files, args.min_delay, args.max_delay, args.delay, args.output)
+        return {}
+    else:
+        logger.debug("Running in Linux.")
+        return print_in_linux(
+            args.visible, args.files, delay, args.output, batch_size=args.batch_size,
+            jobs=args.jobs, libreoffice_jobs=args.libreoffice_jobs, cups_jobs=args.cups_jobs
+        )
+
+
+# Daemon mode
+
+class _QueuedJob:
+    def __init__(self, job_id: int, request: dict):
+        self.job_id = job_id
+        self.request = request
+        self.result: Optional[dict] = None
+        self.done = threading.Event()
+
+
+def _run_job_request(request: dict) -> dict:
+    """Run a job received by the daemon. Executed inside a JobWorker process."""
+    start = time.monotonic()
+    try:
+        os.chdir(request["cwd"])
+        args, _ = _build_parser().parse_known_args(request["argv"])
+        _apply_args(args)
+        errors = run_job(args)
+        result = {"status": "failed" if errors else "done", "errors": {f: str(e) for f, e in errors.items()}}
+    except SystemExit as e:
+        result = {"status": "failed", "error": f"Job exited with code {e.code}."}
+    except Exception as e:
+        logger.error(f"Job failed: {e}")
+        result = {"status": "failed", "error": str(e)}
+    finally:
+        save_mime_cache()
+        finish_tracing()
+    result["elapsed"] = time.monotonic() - start
+    return result
+
+
+def _job_worker_loop(conn, max_jobs: int):
+    _setup_locks()  # filelock refuses lock objects inherited across fork
+    try:
+        for _ in range(max_jobs):
+            try:
+                request = conn.recv()
+            except EOFError:
+                return
+            conn.send(_run_job_request(request))
+    finally:
+        close_libreoffice_pool()
+        flush_logs()  # The worker process exits without running the atexit handlers
+
+
+class JobWorker:
+    """
+    Forked child process that runs daemon jobs sent over a pipe.
+    It inherits the initialized state of the daemon and exits after `max_jobs` jobs so it can be recycled.
+    """
+    def __init__(self, max_jobs: int):
+        import multiprocessing
+        context = multiprocessing.get_context("fork")
+        self.conn, child_conn = context.Pipe()
+        self.max_jobs = max_jobs
+        self.jobs = 0
+        self.proc = context.Process(target=_job_worker_loop, args=(child_conn, max_jobs), daemon=True)
+        self.proc.start()
+        child_conn.close()
+        logger.debug(f"Job worker started (PID: {self.proc.pid}).")
+
+    def is_exhausted(self) -> bool:
+        return self.jobs >= self.max_jobs or not self.proc.is_alive()
+
+    def run(self, request: dict) -> dict:
+        self.conn.send(request)
+        self.jobs += 1
+        return self.conn.recv()
+
+    def close(self):
+        self.conn.close()
+        self.proc.join(timeout=10)
+        if self.proc.is_alive():
+            self.proc.kill()
+            self.proc.join()
+        logger.debug(f"Job worker stopped after {self.jobs} job(s) (PID: {self.proc.pid}).")
+
+
+class PrintServer:
+    """
+    Accept print jobs over a Unix socket and run them in recycled worker processes.
+    Every request is one JSON line: {"argv": [...], "cwd": "...", "wait": bool}.
+    Jobs beyond `queue_size` waiting ones are rejected.
+    """
+    def __init__(self, socket_path: str, queue_size: int, workers: int, max_jobs_per_worker: int):
+        self.socket_path = socket_path
+        self.workers = workers
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.job_ids = itertools.count(1)
+        self.sock: Optional["socket.socket"] = None
+
+    def _dispatch(self):
+        worker = None
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            if worker is None:
+                worker = JobWorker(self.max_jobs_per_worker)
+            logger.info(f"Running job {job.job_id}.")
+            try:
+                job.result = worker.run(job.request)
+            except (EOFError, OSError) as e:
+                job.result = {"status": "failed", "error": f"Job worker died: {e}"}
+            logger.info(f"Job {job.job_id} finished with status {job.result['status']}.")
+            job.done.set()
+            if worker.is_exhausted():
+                worker.close()
+                worker = None
+        if worker is not None:
+            worker.close()
+
+    def _reply(self, conn: "socket.socket", message: dict):
+        conn.sendall((json.dumps(message) + "\n").encode())
+
+    def _handle_client(self, conn: "socket.socket"):
+        with conn:
+            try:
+                line = conn.makefile("r").readline()
+                request = json.loads(line)
+                argv = [str(a) for a in request["argv"]]
+                _build_parser().parse_known_args(argv)  # Reject malformed jobs before queuing them
+            except SystemExit:
+                self._reply(conn, {"status": "rejected", "reason": "invalid job arguments"})
+                return
+            except (ValueError, KeyError, TypeError, OSError) as e:
+                self._reply(conn, {"status": "rejected", "reason": f"invalid request: {e}"})
+                return
+
+            job = _QueuedJob(next(self.job_ids), {"argv": argv, "cwd": request.get("cwd") or os.getcwd()})
+            try:
+                self.jobs.put_nowait(job)
+            except queue.Full:
+                logger.warning(f"Job queue is full, rejecting job {job.job_id}.")
+                self._reply(conn, {"status": "rejected", "reason": "queue full"})
+                return
+            self._reply(conn, {"status": "accepted", "job_id": job.job_id, "queued": self.jobs.qsize()})
+
+            if request.get("wait"):
+                job.done.wait()
+                self._reply(conn, dict(job.result, job_id=job.job_id))
+
+    def _remove_stale_socket(self):
+        """
+        Remove the socket left by a previous daemon. Raises RuntimeError if the path is not a socket
+        of the current user or if a daemon is still listening on it.
+        """
+        import socket
+        try:
+            st = os.lstat(self.socket_path)
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+            raise RuntimeError(f"{self.socket_path} exists and is not a socket of the current user, not replacing it.")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(self.socket_path)
+            except ConnectionRefusedError:
+                os.unlink(self.socket_path)
+                return
+        raise RuntimeError(f"Another daemon is already listening on {self.socket_path}.")
+
+    def serve_forever(self):
+        import socket
+        self._remove_stale_socket()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o077)  # The socket is created with 0600 permissions, never reachable by other users
+        try:
+            self.sock.bind(self.socket_path)
+        finally:
+            os.umask(umask)
+        self.sock.listen()
+        logger.info(f"Listening for jobs on {self.socket_path}.")
+
+        dispatchers = [threading.Thread(target=self._dispatch, daemon=True) for _ in range(self.workers)]
+        for dispatcher in dispatchers:
+            dispatcher.start()
+        try:
+            while True:
+                conn, _ = self.sock.accept()
+                threading.Thread(target=self._handle_client, args=(conn,), daemon=True).start()
+        finally:
+            self.sock.close()
+            os.unlink(self.socket_path)
+            for _ in dispatchers:
+                self.jobs.put(None)
+            for dispatcher in dispatchers:
+                dispatcher.join()
+
+
+def serve_main(argv: List[str]):
+    parser = argparse.ArgumentParser(
+        prog='printer-simulation serve',
+        description='Keep an initialized printer-simulation process running and accept jobs over a Unix socket.',
+    )
+    parser.add_argument('--socket', type=str, default=DEFAULT_SOCKET_PATH, help=f'Path of the Unix socket. Default: {DEFAULT_SOCKET_PATH}.')
+    parser.add_argument('--queue-size', type=int, default=100, help='Maximum number of waiting jobs, more are rejected. Default: 100.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of jobs run at the same time. Default: 1.')
+    parser.add_argument('--max-jobs-per-worker', type=int, default=50, help='Jobs run by a worker process before it is replaced. Default: 50.')
+    parser.add_argument('--no-display', action='store_true', help='Do not wait for a graphical session (only invisible jobs will work).')
+    parser.add_argument('--debug', action='store_true', help='Enable debug mode.')
+    args = parser.parse_args(argv)
+
+    _setup_console_logging(args.debug)
+    logger.info("Starting printer-simulation daemon.")
+    init(check_display=not args.no_display)
+
+    # Turn SIGTERM into a clean shutdown
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    server = PrintServer(args.socket, args.queue_size, max(1, args.workers), max(1, args.max_jobs_per_worker))
+    try:
+        server.serve_forever()
+    except RuntimeError as e:
+        logger.error(f"Could not start the daemon: {e}")
+        exit(1)
+    except KeyboardInterrupt:
+        logger.warning("printer-simulation daemon interrupted by user.")
+    finally:
+        logger.info("Finishing printer-simulation daemon.")
+
+
+def submit_main(argv: List[str]) -> int:
+    """Send a job to a running daemon. The job takes the same arguments as a normal run."""
+    parser = argparse.ArgumentParser(
+        prog='printer-simulation submit',
+        description='Submit a print job to a running printer-simulation daemon. Any other argument is passed to the job.',
+    )
+    parser.add_argument('--socket', type=str, default=DEFAULT_SOCKET_PATH, help=f'Path of the Unix socket. Default: {DEFAULT_SOCKET_PATH}.')
+    parser.add_argument('--wait', action='store_true', help='Wait for the job to finish and report its result.')
+    args, job_argv = parser.parse_known_args(argv)
+    _setup_console_logging(False)
+
+    import socket
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(args.socket)
+            sock.sendall((json.dumps({"argv": job_argv, "cwd": os.getcwd(), "wait": args.wait}) + "\n").encode())
+            replies = sock.makefile("r")
+            reply = json.loads(replies.readline())
+            if reply["status"] != "accepted":
+                logger.error(f"Job rejected: {reply.get('reason')}.")
+                return 1
+            logger.info(f"Job {reply['job_id']} accepted ({reply['queued']} job(s) queued).")
+            if not args.wait:
+                return 0
+            reply = json.loads(replies.readline())
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not submit the job to {args.socket}: {e}")
+        return 1
+
+    if reply["status"] == "done":
+        logger.info(f"Job {reply['job_id']} done in {reply['elapsed']:.2f} seconds.")
+        return 0
+    logger.error(f"Job {reply['job_id']} failed: {reply.get('error') or reply.get('errors')}")
+    return 1
+
+
+# Workload scheduler
+
+def build_schedule(spec: dict, start_time: float) -> List[Tuple[float, dict]]:
+    """
+    Precompute the arrivals of a workload spec as (offset in seconds, mix entry) pairs.
+
+    The spec has the keys:
+      - "duration": length of the plan in seconds.
+      - "jobs_per_hour": average arrival rate.
+      - "arrivals": "poisson" (constant rate) or "profile" (rate shaped by "profile").
+      - "profile": 24 relative weights, one per hour of the day (local time).
+      - "mix": list of {"weight": w, "files": [...], "args": [...]} job types.
+      - "seed": optional seed to make the plan reproducible.
+    """
+    rng = random.Random(spec.get("seed"))
+    duration = float(spec["duration"])
+    rate = float(spec["jobs_per_hour"]) / 3600.0
+    mix = spec["mix"]
+    weights = [float(entry.get("weight", 1.0)) for entry in mix]
+    if rate <= 0 or duration <= 0 or not mix:
+        raise ValueError("The workload needs a positive duration, a positive jobs_per_hour and a non-empty mix.")
+
+    if spec.get("arrivals", "poisson") == "profile":
+        profile = [float(w) for w in spec["profile"]]
+        if len(profile) != 24 or max(profile) <= 0:
+            raise ValueError("The profile must have 24 hourly weights, at least one of them positive.")
+        mean = sum(profile) / 24
+        shape = lambda offset: profile[time.localtime(start_time + offset).tm_hour] / mean
+        peak = max(profile) / mean
+    else:
+        shape = lambda offset: 1.0
+        peak = 1.0
+
+    # Non-homogeneous Poisson process by thinning: draw at the peak rate and keep each arrival with rate(t) / peak
+    plan = []
+    offset = 0.0
+    while True:
+        offset += rng.expovariate(rate * peak)
+        if offset >= duration:
+            break
+        if rng.random() < shape(offset) / peak:
+            plan.append((offset, rng.choices(mix, weights=weights)[0]))
+    return plan
+
+
+def _entry_argv(entry: dict, common_args: List[str]) -> List[str]:
+    return [str(a) for a in entry.get("files", [])] + [str(a) for a in entry.get("args", [])] + common_args
+
+
+def shared_job_options(mix: List[dict], common_args: List[str]) -> argparse.Namespace:
+    """
+    Return the arguments of the first mix entry, after checking that every entry agrees on GLOBAL_OPTIONS.
+    Jobs running at the same time share those settings, so they cannot change from one job to another.
+    Raises ValueError naming the options that differ.
+    """
+    parsed = [_build_parser().parse_known_args(_entry_argv(entry, common_args))[0] for entry in mix]
+    differing = [
+        name for name in GLOBAL_OPTIONS
+        if len({repr(getattr(args, name)) for args in parsed}) > 1
+    ]
+    if differing:
+        options = ", ".join("--" + name.replace("_", "-") for name in differing)
+        raise ValueError(f"With several workers, every mix entry must use the same {options}.")
+    return parsed[0]
+
+
+def run_schedule(plan: List[Tuple[float, dict]], common_args: List[str], workers: int = 1) -> dict:
+    """
+    Execute a precomputed plan with a timer queue, handing every job to a pool of `workers` threads.
+    With several workers, GLOBAL_OPTIONS are applied once for all the jobs (see shared_job_options).
+    Returns a summary with the number of jobs, the failures and the start jitter (seconds late).
+    """
+    import sched
+    import statistics
+    scheduler = sched.scheduler(time.monotonic, time.sleep)
+    start = time.monotonic()
+    jitters = []
+    failures = []
+    lock = threading.Lock()
+    if workers > 1 and plan:
+        _apply_args(shared_job_options(list({id(entry): entry for _, entry in plan}.values()), common_args))
+
+    def run(job_number: int, planned: float, entry: dict):
+        jitter = time.monotonic() - planned
+        with lock:
+            jitters.append(jitter)
+        argv = _entry_argv(entry, common_args)
+        logger.info(f"Scheduled job {job_number} starting ({jitter * 1000:.0f} ms late): {' '.join(argv)}")
+        try:
+            args, _ = _build_parser().parse_known_args(argv)
+            if workers == 1:  # Otherwise the globals would change under the jobs still running
+                _apply_args(args)
+            errors = run_job(args)
+        except SystemExit as e:
+            errors = {"job": e}
+        except Exception as e:
+            logger.error(f"Scheduled job {job_number} failed: {e}")
+            errors = {"job": e}
+        if errors:
+            with lock:
+                failures.append(job_number)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for job_number, (offset, entry) in enumerate(plan, 1):
+            planned = start + offset
+            # The timer only hands the job over, so a long job never delays the next arrival
+            scheduler.enterabs(planned, 0, lambda n=job_number, p=planned, e=entry: executor.submit(run, n, p, e))
+        scheduler.run()
+
+    return {
+        "jobs": len(plan),
+        "failed": failures,
+        "jitter_p50": statistics.median(jitters) if jitters else 0.0,
+        "jitter_max": max(jitters) if jitters else 0.0,
+    }
+
+
+def schedule_main(argv: List[str]):
+    parser = argparse.ArgumentParser(
+        prog='printer-simulation schedule',
+        description='Run a generated workload (arrival process and file type mix) from a single process. Any other argument is passed to every job.',
+    )
+    parser.add_argument('spec', type=str, help='JSON workload spec (duration, jobs_per_hour, arrivals, profile, mix, seed).')
+    parser.add_argument('--workers', type=int, default=1, help='Jobs run at the same time. Default: 1.')
+    parser.add_argument('--dry-run', action='store_true', help='Only print the precomputed plan.')
+    parser.add_argument('--no-display', action='store_true', help='Do not wait for a graphical session (only invisible jobs will work).')
+    args, common_args = parser.parse_known_args(argv)
+    _setup_console_logging('--debug' in common_args)
+
+    try:
+        with open(args.spec, encoding="utf-8") as f:
+            spec = json.load(f)
+        plan = build_schedule(spec, time.time())
+        if args.workers > 1:
+            shared_job_options(spec["mix"], common_args)
+    except (OSError, ValueError, KeyError) as e:
+        logger.error(f"Invalid workload spec {args.spec}: {e}")
+        exit(1)
+
+    logger.info(f"Workload plan: {len(plan)} job(s) over {float(spec['duration']):.0f} seconds.")
+    if args.dry_run:
+        for offset, entry in plan:
+            logger.info(f"  +{offset:9.1f}s  {' '.join(str(a) for a in entry.get('files', []) + entry.get('args', []))}")
+        return
+
+    init(check_display=not args.no_display)
+    try:
+        summary = run_schedule(plan, common_args, max(1, args.workers))
+        logger.info(
+            f"Workload finished: {summary['jobs']} job(s), {len(summary['failed'])} failed, "
+            f"start jitter p50 {summary['jitter_p50'] * 1000:.0f} ms, max {summary['jitter_max'] * 1000:.0f} ms."
+        )
+    except KeyboardInterrupt:
+        logger.warning("Workload interrupted by user.")
+        enable_user_input()
+    finally:
+        close_libreoffice_pool()
+        save_mime_cache()
+        finish_tracing()
+
+
+def main():
+    if sys.argv[1:2] == ['--input-worker']:  # Internal mode used by InputSimulationSession
+        _input_worker_main()
+        return
+    if sys.argv[1:2] == ['serve']:
+        serve_main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ['submit']:
+        exit(submit_main(sys.argv[2:]))
+    if sys.argv[1:2] == ['schedule']:
+        schedule_main(sys.argv[2:])
+        return
+
+    parser = _build_parser()
+
+    # Parse arguments
+    args, unknown = parser.parse_known_args()
+
+    _setup_console_logging(args.debug)
 
+    logger.info("Starting printer-simulation.")
+    if unknown:
+        logger.warning(f"Unknown arguments ignored: {unknown}")
+
+    _apply_args(args)
+
+    init(check_display=bool(args.visible))
+    
+    try:
+        run_job(args)
     except KeyboardInterrupt:
         logger.warning("printer-simulation interrupted by user. Closing any open processes...")
         if FILE_PROGRAM_PROC:
@@ -994,6 +4090,10 @@ def main():
             
         enable_user_input()
     finally:
+        REAPER.shutdown()
+        close_libreoffice_pool()
+        save_mime_cache()
+        finish_tracing()
         logger.info("Finishing printer-simulation.")
 
 